@@ -0,0 +1,149 @@
+#-------------------------------------------------------------------------------
+# Purpose:     compares the frame timing of all the sessions of framerate/:
+#              distribution, percentiles, frame drops and drift of the frame
+#              intervals of each session, in a single table (and plot).
+#
+# usage: python analyse_framerate.py [directory] [-r FRAME_RATE] [-o table.csv] [-p plot.png]
+#-------------------------------------------------------------------------------
+import os
+import glob
+import ntpath
+import argparse
+import numpy as np
+
+import frame_records
+
+path_input = "framerate/"
+PERCENTILES = [50, 95, 99]
+COLUMNS = ["frames", "mean", "sd"] + ["p%d"%p for p in PERCENTILES] + ["max", "drops", "drop_rate", "drift"]
+
+def loadSession(path_to_file, cache = False):
+    ''' intervals (ms) of the frames of a session, and a mask of the frames to analyse.
+    .bin: records of frame_records.FrameRecorder, the frames 0 and 1 of the trials are excluded (inter-trial interval, key press)
+    .txt: intervals saved by np.savetxt (older sessions), all the frames are kept.
+    With cache, the .txt files are converted once into a .npy file next to them. '''
+    if path_to_file.endswith(".bin"):
+        records = np.fromfile(path_to_file, dtype = frame_records.FRAME_RECORD_DTYPE)
+        return records["interval"].astype(float), records["frame"] > 1
+    path_to_cache = os.path.splitext(path_to_file)[0] + ".npy"
+    if cache and os.path.exists(path_to_cache) and os.path.getmtime(path_to_cache) >= os.path.getmtime(path_to_file):
+        intervals = np.load(path_to_cache)
+    else:
+        intervals = np.loadtxt(path_to_file, ndmin = 1).astype(float)
+        if cache:
+            np.save(path_to_cache, intervals)
+    return intervals, np.ones(len(intervals), dtype = bool)
+
+def findSessions(directory):
+    ''' FPS-<block>-<subject>.bin or .txt files, the binary file is preferred when both exist '''
+    sessions = {}
+    for path in sorted(glob.glob(os.path.join(directory, "FPS-*.txt"))) + sorted(glob.glob(os.path.join(directory, "FPS-*.bin"))):
+        name = os.path.splitext(ntpath.basename(path))[0]
+        if not name.endswith(("-trials", "-saccades")): ## reports of run_trials.saveTimingReport
+            sessions[name] = path
+    return sorted(sessions.items())
+
+def sessionStatistics(intervals, session, nb_sessions, frame_rate = 100.0, drop_factor = 1.5):
+    ''' statistics of the intervals of each session in one pass (session: index of the session of each interval).
+    Returns an array (sessions x COLUMNS): the drops are the intervals longer than drop_factor periods,
+    the drift is the slope of the intervals along the session (ms per hour of session). '''
+    count = np.bincount(session, minlength = nb_sessions).astype(float)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mean = np.bincount(session, intervals, nb_sessions) / count
+        sd = np.sqrt(np.maximum(np.bincount(session, intervals**2, nb_sessions) / count - mean**2, 0))
+        ## percentiles (nearest rank) on the intervals sorted within their session
+        order = np.lexsort((intervals, session))
+        offsets = np.concatenate(([0], np.cumsum(count)[:-1])).astype(int)
+        last = np.maximum(count - 1, 0)
+        percentiles = [intervals[order][np.minimum(offsets + np.round(p/100. * last).astype(int), len(intervals)-1)] if len(intervals) else np.zeros(nb_sessions)
+                       for p in PERCENTILES + [100]]
+        drops = np.bincount(session, intervals > drop_factor * 1000.0/frame_rate, nb_sessions)
+        ## drift: least-square slope of the interval against the time elapsed in the session
+        cumulated = np.cumsum(intervals)
+        before = np.concatenate(([0], cumulated)) ## time elapsed before each interval, since the first session
+        elapsed = cumulated - np.repeat(before[offsets], count.astype(int))
+        mean_t = np.bincount(session, elapsed, nb_sessions) / count
+        covariance = np.bincount(session, elapsed*intervals, nb_sessions) / count - mean_t*mean
+        variance = np.bincount(session, elapsed**2, nb_sessions) / count - mean_t**2
+        drift = covariance / variance * 3600. * 1000.
+    table = np.column_stack([count, mean, sd] + percentiles + [drops, drops/count, drift])
+    table[count == 0, 1:] = np.nan
+    return table
+
+def printTable(names, table):
+    width = max([len(n) for n in names] + [7])
+    print "%-*s"%(width, "session") + "".join("%11s"%c for c in COLUMNS)
+    for name, row in zip(names, table):
+        print "%-*s"%(width, name) + "%11d"%row[0] + "".join("%11.3f"%v for v in row[1:-3]) + "%11d%11.4f%11.3f"%tuple(row[-3:])
+
+def plotSessions(names, table, path_to_plot):
+    import matplotlib.pyplot as plt ## only needed for the plot
+    if path_to_plot:
+        plt.switch_backend("Agg")
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharex = True, figsize = (max(6, 0.4*len(names)), 8))
+    x = np.arange(len(names))
+    ax1.vlines(x, table[:, 3], table[:, -4], color = "gray") ## median to max
+    for i, p in enumerate(PERCENTILES):
+        ax1.plot(x, table[:, 3+i], "o", label = "p%d"%p)
+    ax1.set_ylabel("frame interval (ms)")
+    ax1.legend(loc = "best")
+    ax2.bar(x, 100*table[:, -2], color = "firebrick")
+    ax2.set_ylabel("frames dropped (%)")
+    ax2.set_xticks(x)
+    ax2.set_xticklabels(names, rotation = 90)
+    fig.tight_layout()
+    if path_to_plot:
+        fig.savefig(path_to_plot)
+    else:
+        plt.show()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Frame timing of all the sessions of a framerate directory.")
+    parser.add_argument("directory", nargs = "?", default = path_input)
+    parser.add_argument("-r", "--frame-rate", type = float, default = 100.0, help = "refresh rate of the screen (Hz)")
+    parser.add_argument("-d", "--drop-factor", type = float, default = 1.5, help = "a frame is dropped above this number of periods")
+    parser.add_argument("-m", "--max-interval", type = float, default = 1000.0,
+                        help = "intervals longer than this (ms) are pauses, not frames (breaks, key presses)")
+    parser.add_argument("-s", "--sort", choices = ["name"] + COLUMNS, default = "drop_rate", help = "column to sort the table by")
+    parser.add_argument("-o", "--output", help = "saves the table as CSV")
+    parser.add_argument("-p", "--plot", nargs = "?", const = "", help = "plots the sessions (in a file if given)")
+    parser.add_argument("--cache", action = "store_true", help = "converts the .txt logs into .npy files to load them faster next time")
+    args = parser.parse_args()
+
+    sessions = findSessions(args.directory)
+    if not sessions:
+        print "No FPS-*.txt or FPS-*.bin file in", args.directory
+        return
+    names, empty = [], []
+    intervals, session = [], []
+    for name, path in sessions:
+        values, keep = loadSession(path, args.cache)
+        keep &= values <= args.max_interval
+        if not keep.any(): ## e.g. a session aborted before its first trial: its .bin file is created at the start
+            empty.append(name)
+            continue
+        intervals.append(values[keep])
+        session.append(np.zeros(keep.sum(), dtype = int) + len(names))
+        names.append(name)
+    if empty:
+        print "No frame to analyse in:", ", ".join(empty)
+    if not names:
+        return
+    table = sessionStatistics(np.concatenate(intervals), np.concatenate(session), len(names), args.frame_rate, args.drop_factor)
+
+    if args.sort == "name":
+        order = np.arange(len(names))
+    else:
+        order = np.argsort(-np.nan_to_num(table[:, COLUMNS.index(args.sort)]), kind = "mergesort")
+    names, table = [names[i] for i in order], table[order]
+    printTable(names, table)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(",".join(["session"] + COLUMNS) + "\n")
+            for name, row in zip(names, table):
+                f.write(",".join([name] + ["%g"%v for v in row]) + "\n")
+    if args.plot is not None:
+        plotSessions(names, table, args.plot)
+
+if __name__ == '__main__':
+    main()
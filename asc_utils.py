@@ -0,0 +1,505 @@
+import numpy as np
+import re
+import os
+import time
+import json
+import hashlib
+from array import array
+
+## Parsing of the ASC files produced by edf2asc (with the -vel option):
+## sample lines are: time | xp | yp | ps | xv | yv | (flags...)
+## missing values are written as "." by edf2asc, they become NaN here.
+NB_SAMPLE_COLUMNS = 6
+DIGITS = "0123456789"
+MISSING = {".": "nan"}
+## to increase each time the content of the output files changes, it invalidates the manifest
+PARSER_VERSION = 9
+MANIFEST_NAME = "manifest.json"
+
+def readASC(path_to_file, events = None, parser_events = None):
+    ''' Reads an ASC file in a single pass.
+    Sample lines are recognised by their first character and parsed on the fly into
+    a growable buffer of float64 (no string copy of the samples is kept).
+    Returns:
+        par: | trial id | trial type | fixation ON | stimuli ON | distractor OFF | end time | target ecc | target dir | type code
+        samples: | time | xp | yp | ps | xv | yv  (float64, "." replaced by NaN)
+    The MSG lines are appended to the list "events" if given (see parseMessage),
+    and the EFIX/ESACC/EBLINK lines to the lists of the dictionary "parser_events" if given (see newParserEvents).
+    '''
+    samples = array("d")
+    par, nb_samples = scanASC(path_to_file, samples, events, parser_events)
+    return par, toSampleArray(samples)
+
+def scanASC(path_to_file, samples = None, events = None, parser_events = None):
+    ''' Reads the trial messages of an ASC file and returns (par, number of samples).
+    The samples are parsed into the buffer "samples" (an array("d")) if given, otherwise they are only counted.
+    The MSG lines are parsed into the list "events" and the fixations, saccades and blinks detected by the
+    EyeLink parser into the dictionary "parser_events", if given.
+    par has one row per TRIALID message (older or current format, see parseTrialID), filled by the events which
+    follow it: Fixation ON, Fixation OFF (stimuli ON), Distractor OFF (NaN in the current recordings), the END line,
+    and the polar position of S1 when the TRIALID doesn't give the target eccentricity and direction. '''
+    rows = [] ## | trial id | trial type | fixation ON | stimuli ON | distractor OFF | end time | target ecc | target dir | type code
+    nb_samples = 0
+    current_trial = 0
+    with open(path_to_file) as f:
+        for line in f:
+            if line[0] in DIGITS:
+                nb_samples += 1
+                if samples is not None:
+                    parseSampleLine(line, samples)
+                continue
+
+            if parser_events is not None and line[0] == "E":
+                kind = line.split(None, 1)[0]
+                if kind in PARSER_EVENTS:
+                    parser_events[PARSER_EVENTS[kind][0]].append(parseParserEvent(line, len(PARSER_EVENTS[kind][1])))
+                    continue
+
+            if line.startswith("MSG"):
+                event = parseMessage(line, current_trial)
+                current_trial, timestamp, kind = event[:3]
+                if events is not None:
+                    events.append(event)
+                if kind == EVENT_CODES["TRIALID"]:
+                    trial_id, trial_type, ecc, direction, code = parseTrialID(splitMessage(line)[1])
+                    rows.append([trial_id, trial_type, np.nan, np.nan, np.nan, np.nan, ecc, direction, code])
+                elif rows and kind in TRIAL_COLUMNS and np.isnan(rows[-1][TRIAL_COLUMNS[kind]]):
+                    rows[-1][TRIAL_COLUMNS[kind]] = timestamp
+                elif rows and kind == EVENT_CODES["S1_ON"] and np.isnan(rows[-1][6]):
+                    rows[-1][6], rows[-1][7] = event[3], event[4]
+            elif line.startswith("END") and rows and np.isnan(rows[-1][5]):
+                rows[-1][5] = int(line.split()[1])
+
+    par = np.array(rows, dtype = float).reshape(-1, 9)
+    return par, nb_samples
+
+MISSING_ROW = [np.nan]*NB_SAMPLE_COLUMNS
+
+def parseSampleLine(line, samples):
+    ''' appends the 6 first columns of a sample line to the array("d") samples '''
+    fields = line.split(None, NB_SAMPLE_COLUMNS)[:NB_SAMPLE_COLUMNS]
+    samples.extend([float(MISSING.get(v, v)) for v in fields])
+    if len(fields) < NB_SAMPLE_COLUMNS: ## keep the rows aligned
+        samples.extend(MISSING_ROW[len(fields):])
+
+def toSampleArray(samples):
+    if len(samples) == 0:
+        return np.zeros((0, NB_SAMPLE_COLUMNS))
+    return np.frombuffer(samples, dtype=float).reshape(-1, NB_SAMPLE_COLUMNS)
+
+## Messages sent by run_trials (and by the previous versions of the experiment), in the order they are tested:
+EVENT_KINDS = [("OTHER", None), ("TRIALID", "TRIALID"), ("TRIAL_RESULT", "TRIAL_RESULT"),
+               ("FIXATION_ON", "Fixation ON"), ("FIXATION_PRESSED", "Fixation PRESSED"), ("FIXATION_OFF", "Fixation OFF"),
+               ("S1_ON", "S1 ON"), ("S1_OFF", "S1 OFF"), ("S2_ON", "S2 ON"), ("S2_OFF", "S2 OFF"),
+               ("DISTRACTOR_OFF", "Distractor OFF"), ("FRAME_DROP", "FRAME DROP"),
+               ("FIXATION_FIXATED", "Fixation FIXATED"), ("SACCADE_DETECTED", "SACCADE DETECTED")]
+EVENT_CODES = dict((name, code) for code, (name, pattern) in enumerate(EVENT_KINDS))
+TRIAL_COLUMNS = {EVENT_CODES["FIXATION_ON"]: 2, EVENT_CODES["FIXATION_OFF"]: 3, EVENT_CODES["DISTRACTOR_OFF"]: 4} ## columns of par set by the events
+EVENT_DTYPE = [("trial", np.int32), ("time", np.int64), ("kind", np.int8),
+               ("r", np.float32), ("theta", np.float32), ("synctime", np.float32)] ## polar position and synctime are NaN if absent
+POSITION_RE = re.compile(r"(?:ON|OFF|PRESSED|FIXATED)\s+(-?[\d.]+)\s+(-?[\d.]+)")
+SYNCTIME_RE = re.compile(r"SYNCTIME\s+(-?\d+)")
+
+def splitMessage(line):
+    ''' "MSG <time> [offset] <text>" -> (time, text)
+    If the text starts with an offset (message sent after the event, see utils.MessageQueue), it is removed from the time. '''
+    parts = line.split(None, 2)
+    timestamp = int(float(parts[1]))
+    text = parts[2] if len(parts) > 2 else ""
+    words = text.split(None, 1)
+    if words and words[0].lstrip("-").isdigit():
+        timestamp -= int(words[0])
+        text = words[1] if len(words) > 1 else ""
+    return timestamp, text
+
+def parseTrialID(text):
+    ''' text of a TRIALID message -> [trial id, trial type, target ecc, target dir, type code]
+    older version: "TRIALID [ntrial trial_type ecc dir ... code" (ntrial starting from 0)
+    current version: "TRIALID <ntrial> TRIAL_TYPE <type> CODE_TYPE <code>" (no target position: NaN) '''
+    if "[" in text:
+        t = np.array(text.split("[")[1].split(), dtype=float) # barbarian way
+        return [int(t[0]+1), int(t[1]), t[2], t[3], t[-1] if len(t) > 4 else 0] ## the type code is the last column of the table of trials
+    words = text.split()
+    fields = dict(zip(words[2::2], words[3::2]))
+    return [int(float(words[1])), int(float(fields.get("TRIAL_TYPE", 0))), np.nan, np.nan, float(fields.get("CODE_TYPE", 0))]
+
+def parseMessage(line, current_trial = 0):
+    ''' "MSG <time> [offset] <text>" -> (trial, time, kind, r, theta, synctime)
+    The trial is the one of the last TRIALID message (current_trial), or the one given by the message if it is a TRIALID.
+    The time is the one of the event (see splitMessage). '''
+    timestamp, text = splitMessage(line)
+    kind = 0
+    for code, (name, pattern) in enumerate(EVENT_KINDS[1:]):
+        if pattern in text:
+            kind = code+1
+            break
+    r, theta, synctime = np.nan, np.nan, np.nan
+    position = POSITION_RE.search(text)
+    if position:
+        r, theta = float(position.group(1)), float(position.group(2))
+    sync = SYNCTIME_RE.search(text)
+    if sync:
+        synctime = float(sync.group(1))
+    if kind == EVENT_CODES["TRIALID"]:
+        current_trial = parseTrialID(text)[0]
+    return current_trial, timestamp, kind, r, theta, synctime
+
+def toEventArray(events):
+    return np.array(events, dtype = EVENT_DTYPE)
+
+def eventTimes(events, kind, trial_ids):
+    ''' time of the first event of a kind (e.g. "S1_ON") in each trial, NaN if absent.
+    trial_ids has to be sorted (the column "id" of a table of trials) '''
+    times = np.zeros(len(trial_ids)) + np.nan
+    if len(trial_ids) == 0:
+        return times
+    selection = events[events["kind"] == EVENT_CODES[kind]][::-1] ## reversed: the first event is written last
+    pos = np.minimum(np.searchsorted(trial_ids, selection["trial"]), len(trial_ids)-1)
+    valid = trial_ids[pos] == selection["trial"]
+    times[pos[valid]] = selection["time"][valid]
+    return times
+
+## Events of the EyeLink parser (enabled by utils.configEDFfile), the lines are:
+## EFIX <eye> <start> <end> <duration> <x> <y> <pupil>
+## ESACC <eye> <start> <end> <duration> <start x> <start y> <end x> <end y> <amplitude> <peak velocity>
+## EBLINK <eye> <start> <end> <duration>
+## positions in pixels, amplitude in degrees, peak velocity in degrees/second, "." (NaN) during blinks
+EYES = {"L": 0, "R": 1}
+FIXATION_DTYPE = [("trial", np.int32), ("eye", np.int8), ("start", np.int64), ("end", np.int64), ("duration", np.int32),
+                  ("x", np.float32), ("y", np.float32), ("pupil", np.float32)]
+SACCADE_DTYPE = [("trial", np.int32), ("eye", np.int8), ("start", np.int64), ("end", np.int64), ("duration", np.int32),
+                 ("start_x", np.float32), ("start_y", np.float32), ("end_x", np.float32), ("end_y", np.float32),
+                 ("amplitude", np.float32), ("peak_velocity", np.float32)]
+BLINK_DTYPE = [("trial", np.int32), ("eye", np.int8), ("start", np.int64), ("end", np.int64), ("duration", np.int32)]
+PARSER_EVENTS = {"EFIX": ("fixations", FIXATION_DTYPE), "ESACC": ("saccades", SACCADE_DTYPE), "EBLINK": ("blinks", BLINK_DTYPE)}
+
+def newParserEvents():
+    return dict((name, []) for name, dtype in PARSER_EVENTS.values())
+
+def parseParserEvent(line, nb_fields):
+    ''' EFIX/ESACC/EBLINK line -> record tuple, the trial (first field) is set later by toParserEventTables '''
+    fields = line.split()
+    values = [float(MISSING.get(v, v)) for v in fields[2:nb_fields]]
+    values += [np.nan]*(nb_fields - 2 - len(values))
+    return tuple([0, EYES.get(fields[1], -1)] + values)
+
+def toParserEventTables(parser_events, par):
+    ''' Structured arrays of the fixations, saccades and blinks, joined to the trial ids (0 out of the trials)
+    with the rule used for the samples (see trialOfSamples) applied on their start time. '''
+    tables = {}
+    for name, dtype in PARSER_EVENTS.values():
+        table = np.array(parser_events[name], dtype = dtype)
+        i = trialOfSamples(table["start"], par)
+        table["trial"] = np.where(i >= 0, par[i, 0], 0)
+        tables[name] = table
+    return tables
+
+def iterSampleChunks(path_to_file, chunk_size):
+    ''' Yields the samples of an ASC file by blocks of chunk_size rows (the memory used does not depend on the file size) '''
+    samples = array("d")
+    size = chunk_size*NB_SAMPLE_COLUMNS
+    with open(path_to_file) as f:
+        for line in f:
+            if line[0] in DIGITS:
+                parseSampleLine(line, samples)
+                if len(samples) >= size:
+                    yield toSampleArray(samples)
+                    samples = array("d")
+    if len(samples) > 0:
+        yield toSampleArray(samples)
+
+def findTrialSegments(times, par):
+    ''' Gives the [start, end) rows of every trial in one call (times have to be monotonic).
+    A trial starts at the first sample after fixation ON and ends on the sample END-1 (excluded). '''
+    start = np.searchsorted(times, par[:,2], side="left")
+    end = np.searchsorted(times, par[:,5]-1, side="left")
+    end = np.maximum(start, end) ## empty segment if the trial has no sample
+    return start, end
+
+def trialOfSamples(times, par):
+    ''' Position in par of the trial of each sample (-1 out of the trials), same rule as findTrialSegments
+    but sample by sample, so that it can be applied on a block of samples. '''
+    if par.shape[0] == 0:
+        return np.zeros(times.shape[0], dtype=int) - 1
+    i = np.searchsorted(par[:,2], times, side="right") - 1
+    inside = (i >= 0) & (times < par[i,5]-1)
+    return np.where(inside, i, -1)
+
+def segmentRows(start, end):
+    ''' indices of all the rows within the [start, end) segments, and the length of each segment '''
+    lengths = end - start
+    rows = np.repeat(start - np.cumsum(lengths) + lengths, lengths) + np.arange(np.sum(lengths))
+    return rows, lengths
+
+def buildDataMatrix(par, samples):
+    ''' | trial id | trial type | fixation ON | stimuli ON | distractor OFF | time | xp | yp | ps | xv | yv |  (11 columns)
+    The trial columns are filled segment by segment with np.repeat (no scan per trial),
+    rows out of any trial keep zeros in the 5 first columns and their raw time. '''
+    datamat = np.zeros((samples.shape[0],11))
+    datamat[:, 5:11] = samples
+    start, end = findTrialSegments(samples[:,0], par)
+    rows, lengths = segmentRows(start, end)
+    datamat[rows, 0:5] = np.repeat(par[:, 0:5], lengths, axis=0)
+    datamat[rows, 5] -= np.repeat(par[:, 2], lengths) ## fixation_ON is the time zero
+    return datamat
+
+## Columnar format: a directory with one .npy file per sample column and a table of trials,
+## the five trial columns of the datamat are not repeated for every sample.
+## Each file can be opened alone with np.load(..., mmap_mode='r').
+SAMPLE_COLUMNS = [("time", np.float64), ("xp", np.float32), ("yp", np.float32),
+                  ("ps", np.float32), ("xv", np.float32), ("yv", np.float32)]
+TRIAL_DTYPE = [("id", np.int32), ("type", np.int16), ("fixation_on", np.int64), ("stimuli_on", np.int64),
+               ("distractor_off", np.float64), ("end_time", np.int64), ("ecc", np.float32), ("dir", np.float32),
+               ("code", np.int32), ("start", np.int64), ("end", np.int64)] ## start/end: rows of the trial in the sample columns
+## distractor_off is NaN in the recordings of the current run_trials (no Distractor OFF message)
+
+def buildTrialTable(par, start, end):
+    trials = np.zeros(par.shape[0], dtype = TRIAL_DTYPE)
+    for i, field in enumerate(["id", "type", "fixation_on", "stimuli_on", "distractor_off", "end_time", "ecc", "dir", "code"]):
+        trials[field] = par[:, i]
+    trials["start"], trials["end"] = start, end
+    return trials
+
+def saveColumns(path_to_dir, par, samples):
+    ''' Writes time.npy, xp.npy, ... in path_to_dir and returns the table of trials (to save with saveTables).
+    The time column is the one of the datamat (the fixation ON is the time zero within the trials). '''
+    if not os.path.isdir(path_to_dir):
+        os.makedirs(path_to_dir)
+    trials = buildTrialTable(par, *findTrialSegments(samples[:,0], par))
+    rows, lengths = segmentRows(trials["start"], trials["end"])
+    times = samples[:,0].copy()
+    times[rows] -= np.repeat(trials["fixation_on"], lengths)
+    np.save(os.path.join(path_to_dir, "time.npy"), times)
+    for i, (name, dtype) in enumerate(SAMPLE_COLUMNS[1:]):
+        np.save(os.path.join(path_to_dir, name + ".npy"), samples[:, i+1].astype(dtype))
+    return trials
+
+def loadColumns(path_to_dir, columns = None, mmap_mode = "r"):
+    ''' Returns the table of trials and a dictionary of the requested sample columns (all by default),
+    memory-mapped unless mmap_mode is None. '''
+    if columns is None:
+        columns = [name for name, dtype in SAMPLE_COLUMNS]
+    trials = loadTable(path_to_dir, "trials")
+    data = dict((name, np.load(os.path.join(path_to_dir, name + ".npy"), mmap_mode = mmap_mode)) for name in columns)
+    return trials, data
+
+def columnsToDataMatrix(trials, data):
+    ''' Rebuilds the 11-column datamat from the columnar format (gaze columns are float32 precision) '''
+    datamat = np.zeros((data["time"].shape[0], 11))
+    for i, (name, dtype) in enumerate(SAMPLE_COLUMNS):
+        datamat[:, 5+i] = data[name]
+    rows, lengths = segmentRows(trials["start"], trials["end"])
+    for i, field in enumerate(["id", "type", "fixation_on", "stimuli_on", "distractor_off"]):
+        datamat[rows, i] = np.repeat(trials[field], lengths)
+    return datamat
+
+def tablePath(path_to_output, name):
+    ''' The tables of a session (trials, events, fixations, saccades, blinks) are saved in its directory of columns
+    (trials.npy, events.npy, ...), or next to its datamat file: S1-np.npy -> S1-np-index.npy (trials), S1-np-events.npy, ... '''
+    if os.path.isdir(path_to_output):
+        return os.path.join(path_to_output, name + ".npy")
+    if name == "trials":
+        name = "index"
+    return os.path.splitext(path_to_output)[0] + "-" + name + ".npy"
+
+def saveTables(path_to_output, tables):
+    for name, table in tables.items():
+        np.save(tablePath(path_to_output, name), table)
+
+def loadTable(path_to_output, name):
+    ''' None if the session has no such table '''
+    path = tablePath(path_to_output, name)
+    if not os.path.isfile(path):
+        return None
+    return np.load(path)
+
+class EyeData():
+    ''' Random access to the trials of an extracted session (datamat file or directory of columns).
+    The table of trials gives the rows of each trial, so a trial is a slice of the data (a view, no copy):
+        data = EyeData("numpy_file/S1-np.npy")
+        data.trial(12)          ## rows of the trial 12 in the datamat
+        data.trialsOfType(2)    ## list of the double-step trials
+        data.eventTimes("S1_ON") ## onset of the first stimulus in each trial (tracker time)
+    With the columnar format, a trial is a dictionary of column slices.
+    A trial id appears once per attempt when the trial is run again (Ctrl+R, run_trials.REPEAT_DROPPED).
+    The last attempt is the one which went to the end: trial() returns it unless an attempt is given,
+    trialsOfType and trialsOfCode keep only the last attempts unless all_attempts. '''
+    def __init__(self, path, columns = None, mmap_mode = "r"):
+        self.path = path
+        if os.path.isdir(path):
+            self.trials, self.data = loadColumns(path, columns, mmap_mode)
+        else:
+            self.trials = loadTable(path, "trials")
+            self.data = np.load(path, mmap_mode = mmap_mode)
+        self.events = loadTable(path, "events")
+        self.fixations = loadTable(path, "fixations")
+        self.saccades = loadTable(path, "saccades")
+        self.blinks = loadTable(path, "blinks")
+        self.attempts = self.groupBy("id") ## rows of each trial id, in the order of the session
+        self.last = np.zeros(len(self.trials), dtype = bool) ## last attempt of each trial id
+        self.last[[rows[-1] for rows in self.attempts.values()]] = True
+        self.by_type = self.groupBy("type")
+        self.by_code = self.groupBy("code")
+
+    def groupBy(self, field):
+        groups = {}
+        for i, value in enumerate(self.trials[field]):
+            groups.setdefault(value, []).append(i)
+        return groups
+
+    def selectRows(self, rows, all_attempts):
+        return [self.getSlice(i) for i in rows if all_attempts or self.last[i]]
+
+    def getSlice(self, i):
+        start, end = self.trials["start"][i], self.trials["end"][i]
+        if isinstance(self.data, dict):
+            return dict((name, column[start:end]) for name, column in self.data.items())
+        return self.data[start:end]
+
+    def trial(self, trial_id, attempt = -1):
+        ''' rows of a trial, by default of its last attempt (0 for the first one) '''
+        return self.getSlice(self.attempts[trial_id][attempt])
+
+    def nbAttempts(self, trial_id):
+        return len(self.attempts.get(trial_id, []))
+
+    def trialsOfType(self, trial_type, all_attempts = False):
+        return self.selectRows(self.by_type.get(trial_type, []), all_attempts)
+
+    def trialsOfCode(self, code, all_attempts = False):
+        return self.selectRows(self.by_code.get(code, []), all_attempts)
+
+    def eventTimes(self, kind):
+        return eventTimes(self.events, kind, self.trials["id"])
+
+    def __len__(self):
+        return len(self.trials)
+
+def convertFile(path_to_file, path_to_output, output_format = "matrix", chunk_size = 0):
+    ''' Reads one ASC file and saves it as a datamat .npy file with its index of trials ("matrix")
+    or as a directory of columns ("columns"). If chunk_size > 0, the file is converted block by block
+    (see convertFileChunked).
+    Returns some information for the progress report and the manifest:
+    (path, nb samples, nb trials, duration in second, signature of the ASC file) '''
+    tick = time.time()
+    if chunk_size > 0:
+        par, nb_samples = convertFileChunked(path_to_file, path_to_output, output_format, chunk_size)
+    else:
+        events = []
+        parser_events = newParserEvents()
+        par, samples = readASC(path_to_file, events, parser_events)
+        nb_samples = samples.shape[0]
+        if output_format == "columns":
+            trials = saveColumns(path_to_output, par, samples)
+        else:
+            np.save(path_to_output, buildDataMatrix(par, samples))
+            trials = buildTrialTable(par, *findTrialSegments(samples[:,0], par))
+        tables = toParserEventTables(parser_events, par)
+        tables.update({"trials": trials, "events": toEventArray(events)})
+        saveTables(path_to_output, tables)
+    signature = fileSignature(path_to_file)
+    signature["output"] = path_to_output
+    return path_to_file, nb_samples, par.shape[0], time.time() - tick, signature
+
+def convertFileChunked(path_to_file, path_to_output, output_format = "matrix", chunk_size = 1<<18):
+    ''' Out-of-core conversion, for sessions which do not fit in memory.
+    A first pass reads the trial messages and counts the samples, the output files are then preallocated
+    on disk (np.lib.format.open_memmap) and filled block by block of chunk_size samples during the second pass.
+    The peak memory is set by chunk_size, the files are the same as the ones of convertFile. '''
+    events = []
+    parser_events = newParserEvents()
+    par, nb_samples = scanASC(path_to_file, None, events, parser_events)
+    if output_format == "columns":
+        if not os.path.isdir(path_to_output):
+            os.makedirs(path_to_output)
+        columns = [np.lib.format.open_memmap(os.path.join(path_to_output, name + ".npy"), mode = "w+", dtype = dtype, shape = (nb_samples,))
+                   for name, dtype in SAMPLE_COLUMNS]
+    else:
+        datamat = np.lib.format.open_memmap(path_to_output, mode = "w+", dtype = float, shape = (nb_samples, 11))
+
+    start = np.zeros(par.shape[0], dtype = int)
+    end = np.zeros(par.shape[0], dtype = int)
+    offset = 0
+    for chunk in iterSampleChunks(path_to_file, chunk_size):
+        n = chunk.shape[0]
+        ## the rows of a trial are counted over the blocks, which gives the same segments as findTrialSegments
+        start += np.searchsorted(chunk[:,0], par[:,2], side="left")
+        end += np.searchsorted(chunk[:,0], par[:,5]-1, side="left")
+        i = trialOfSamples(chunk[:,0], par)
+        inside = i >= 0
+        if output_format == "columns":
+            columns[0][offset:offset+n] = chunk[:,0]
+            columns[0][offset:offset+n][inside] -= par[i[inside], 2]
+            for k in range(1, NB_SAMPLE_COLUMNS):
+                columns[k][offset:offset+n] = chunk[:,k]
+        else:
+            block = datamat[offset:offset+n]
+            block[:, 5:11] = chunk
+            block[inside, 0:5] = par[i[inside], 0:5]
+            block[inside, 5] -= par[i[inside], 2] ## fixation_ON is the time zero
+        offset += n
+
+    if output_format == "columns":
+        for column in columns:
+            column.flush()
+    else:
+        datamat.flush()
+    tables = toParserEventTables(parser_events, par)
+    tables.update({"trials": buildTrialTable(par, start, np.maximum(start, end)), "events": toEventArray(events)})
+    saveTables(path_to_output, tables)
+    return par, nb_samples
+
+def convertTask(task):
+    ''' to be used with a multiprocessing.Pool: task is a tuple (path_to_file, path_to_output[, output_format[, chunk_size]]).
+    Returns the result of convertFile followed by an error message, None if the conversion succeeded:
+    a file which can't be converted gives (path_to_file, 0, 0, duration, None, error) and the batch goes on. '''
+    tick = time.time()
+    try:
+        return convertFile(*task) + (None,)
+    except Exception, e:
+        return task[0], 0, 0, time.time() - tick, None, "%s: %s"%(type(e).__name__, e)
+
+def fileSignature(path_to_file, block_size = 1<<20):
+    ''' size, modification time and SHA-1 of the content of a file, plus the parser version '''
+    sha1 = hashlib.sha1()
+    with open(path_to_file, "rb") as f:
+        block = f.read(block_size)
+        while block:
+            sha1.update(block)
+            block = f.read(block_size)
+    stat = os.stat(path_to_file)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha1.hexdigest(), "parser_version": PARSER_VERSION}
+
+def loadManifest(path_output):
+    path_to_manifest = os.path.join(path_output, MANIFEST_NAME)
+    if not os.path.isfile(path_to_manifest):
+        return {}
+    with open(path_to_manifest) as f:
+        return json.load(f)
+
+def saveManifest(path_output, manifest):
+    path_to_manifest = os.path.join(path_output, MANIFEST_NAME)
+    with open(path_to_manifest + ".tmp", "w") as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+    if os.path.isfile(path_to_manifest): ## os.rename does not replace on Windows
+        os.remove(path_to_manifest)
+    os.rename(path_to_manifest + ".tmp", path_to_manifest)
+
+def isUpToDate(manifest, path_to_file, path_to_output):
+    ''' True if the output exists and was produced from the same content with the same parser version.
+    The file is hashed only when its size or modification time changed (the manifest is then refreshed). '''
+    entry = manifest.get(path_to_file)
+    if entry is None or entry.get("parser_version") != PARSER_VERSION \
+            or entry.get("output") != path_to_output or not os.path.exists(path_to_output) \
+            or not os.path.isfile(tablePath(path_to_output, "events")):
+        return False
+    stat = os.stat(path_to_file)
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime == entry["mtime"]:
+        return True
+    signature = fileSignature(path_to_file)
+    if signature["sha1"] != entry["sha1"]:
+        return False
+    entry["mtime"] = signature["mtime"] ## touched but not modified
+    return True
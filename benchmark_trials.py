@@ -0,0 +1,249 @@
+#-------------------------------------------------------------------------------
+# Purpose:     headless benchmark of the real-time loop of run_trials: runs
+#              run_trials.run_trials end-to-end on the SDL dummy video driver,
+#              with a scripted tracker and synthetic key presses, and reports
+#              the per-frame time spent in each stage of drawCondition.
+#
+#              With -g, the trials start on a stable fixation of a synthetic gaze
+#              (run_trials.GAZE_CONTINGENT) and the cost of each poll is reported,
+#              with -s the gaze makes a saccade to S1, detected online (run_trials.SACCADE_DETECTION).
+#              With -m all, the same trials are run in the 3 render modes in turn.
+#
+# usage: python benchmark_trials.py [-n NB_TRIALS] [-m {fill,cache,dirty,all}] [-t TRIAL_TYPE] [-g RATE [-s]] [-o frames.npy]
+#-------------------------------------------------------------------------------
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") ## must be set before pygame.init
+import argparse
+import tempfile
+import timeit
+import numpy as np
+import pygame
+
+import utils
+import dummy
+import run_trials
+
+## stages of a frame: "fill" is the background (fill, blit of the pre-rendered frame, or erasing in dirty mode),
+## "frame" is the whole frame, from the end of the previous one (frames 0 and 1 excluded: inter-trial interval, key press)
+STAGES = ["fill", "draw", "message", "flip", "pacing", "frame"]
+RENDER_MODES = ["fill", "cache", "dirty"]
+PERCENTILES = [50, 90, 99, 100]
+clock = timeit.default_timer ## on the dummy driver nothing waits, the wall time is the CPU time of the loop
+
+class ScriptedEyeLink(dummy.DummyEyeLink):
+    ''' DummyEyeLink seen as a real tracker by run_trials (no dummy display), which keeps the messages instead of printing them '''
+    def __init__(self):
+        dummy.DummyEyeLink.__init__(self)
+        self.messages = []
+    def sendMessage(self, s):
+        self.messages.append(s)
+    def sendCommand(self, s):
+        pass
+    def startRecording(self, a, b, c, d):
+        return 0
+    def stopRecording(self):
+        pass
+    def getTrackerVersion(self):
+        return 0
+
+class FrameProfiler():
+    ''' time spent in each stage (STAGES) of every frame, the stages are timed by the functions returned by wrap '''
+    def __init__(self, capacity):
+        self.times = np.zeros((capacity, len(STAGES)))
+        self.frames = np.zeros(capacity, dtype = int) ## index of the frame in its trial
+        self.count = 0
+        self.last = None
+        self.polls = [] ## cost of each poll of the gaze-contingent start (s)
+
+    def wrap(self, function, stage):
+        k = STAGES.index(stage)
+        def timed(*args, **kwargs):
+            t0 = clock()
+            result = function(*args, **kwargs)
+            self.times[self.count, k] += clock() - t0
+            return result
+        return timed
+
+    def endFrame(self, frame):
+        now = clock()
+        if self.last is not None:
+            self.times[self.count, -1] = now - self.last
+        self.frames[self.count] = frame
+        self.count += 1
+        self.last = now
+
+    def measured(self):
+        ''' times (ms) of the frames > 1 of the trials '''
+        return self.times[:self.count][self.frames[:self.count] > 1] * 1000.
+
+class Proxy(object):
+    ''' forwards everything to an object, except the methods replaced by the instance attributes '''
+    def __init__(self, target):
+        self._target = target
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+def patch(saved, target, name, value):
+    ''' replaces target.name (module or class attribute) by value, unpatch puts the saved original back '''
+    saved.append((target, name, target.__dict__[name]))
+    setattr(target, name, value)
+
+def unpatch(saved):
+    while saved:
+        target, name, value = saved.pop()
+        setattr(target, name, value)
+
+def makeTable(nb_trials, trial_type = None):
+    ''' trials of the 3 types in turn (or all of trial_type), with the durations of utils (frames at 100 Hz) '''
+    table = np.zeros((nb_trials, 12))
+    table[:, 0] = np.arange(1, nb_trials+1)
+    table[:, 1] = np.arange(nb_trials) % 3 if trial_type is None else trial_type
+    table[:, 2], table[:, 4] = utils.ECCENTRICITY, utils.ECCENTRICITY
+    table[:, 3] = np.resize(utils.POSITION_EXP_LEVELS, nb_trials)
+    table[:, 5] = -table[:, 3]
+    table[:, 7], table[:, 8], table[:, 9] = utils.FIXATION_DURATION[0], utils.GAP_DURATION_LONG[0], utils.STIMULUS1_DOUBLEDURATION_SHORT[0]
+    table[:, 10] = np.where(table[:, 1] == 2, utils.STIMULUS2_DURATION, 0)
+    table[:, 11] = 1111
+    return table
+
+def runBenchmark(nb_trials, render_mode = "cache", pacing = "scheduler", gaze_rate = 0, saccades = False, trial_type = None):
+    ''' runs nb_trials trials of makeTable, returns (FrameProfiler, ScriptedEyeLink).
+    run_trials and utils are restored at the end, so that the benchmark can be run again (in another mode).
+    gaze_rate: the trials start on the fixation of a synthetic gaze streamed at this rate (Hz), not on a key press
+    saccades: after the S1 onset, the synthetic gaze makes a saccade to S1, detected online '''
+    pygame.init()
+    MyMonitor = utils.Monitor("labo-Tom-PC",1280,1024, distance = 72, width_cm = 36.6)
+    MyMonitor.setFPSControl(1000000) ## paced but without waiting: the cost of the pacing only
+    surf = pygame.display.set_mode((MyMonitor.w, MyMonitor.h), 0, 32)
+    table = makeTable(nb_trials, trial_type)
+    MyEyelink = ScriptedEyeLink()
+    profiler = FrameProfiler(int(sum(len(s[0]) for s in run_trials.compileSchedules(table)) * 1.1) + 10)
+
+    ## the stages are timed by wrapping what drawCondition calls
+    screen = Proxy(surf)
+    screen.fill = profiler.wrap(surf.fill, "fill")
+    screen.blit = profiler.wrap(surf.blit, "fill")
+    MyEnv = utils.Environment(screen, MyMonitor, MyEyelink, table, ["benchmark", "0", "0", "XX"])
+    screen_display = Proxy(pygame.display)
+    screen_display.flip = profiler.wrap(pygame.display.flip, "flip")
+    screen_display.update = profiler.wrap(pygame.display.update, "flip")
+    saved = []
+    patch(saved, run_trials, "display", screen_display)
+
+    initStimuli = run_trials.initStimuliO
+    def initTimedStimuli(env):
+        initStimuli(env)
+        for shape in (run_trials.fixation, run_trials.stimulus1, run_trials.stimulus2):
+            shape.mysurf = surf ## the blits of the shapes are in "draw", not in "fill"
+            shape.draw = profiler.wrap(shape.draw, "draw")
+    patch(saved, run_trials, "initStimuliO", initTimedStimuli)
+
+    timedPut = profiler.wrap(utils.MessageQueue.put, "message")
+    def put(queue, frame, event, timestamp):
+        if event == run_trials.EVENT_FIXATION_ON and gaze_rate: ## the subject looks at the fixation point
+            gaze.xy = fixating + run_trials.fixation.pos
+        elif event == run_trials.EVENT_S1_ON and saccades: ## fixation of 150 to 400 ms then saccade to S1
+            gaze.xy = dummy.SaccadeModel(gaze_rate, duration = 2., center = run_trials.fixation.pos,
+                                         targets = [run_trials.stimulus1.pos], fixation = (150, 400), seed = frame).xy
+            gaze.start()
+        elif event == run_trials.EVENT_FIXATION_ON: ## the subject presses a key at the fixation ON (pygame.event.wait)
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key = pygame.K_SPACE, mod = 0, unicode = u" "))
+        return timedPut(queue, frame, event, timestamp)
+    patch(saved, utils.MessageQueue, "put", put)
+    patch(saved, utils.FrameScheduler, "tick", profiler.wrap(utils.FrameScheduler.tick, "pacing"))
+    busy_clock = Proxy(run_trials.clock) ## pacing = "busy_loop"
+    busy_clock.tick_busy_loop = profiler.wrap(run_trials.clock.tick_busy_loop, "pacing")
+    patch(saved, run_trials, "clock", busy_clock)
+
+    path_to_frames = tempfile.mktemp(suffix = ".bin")
+    recorder = utils.FrameRecorder(path_to_frames)
+    record = recorder.record
+    def recordFrame(trial, frame, interval):
+        record(trial, frame, interval)
+        profiler.endFrame(frame)
+    recorder.record = recordFrame
+    patch(saved, run_trials, "FRAME_RECORDER", recorder)
+    patch(saved, run_trials, "RENDER_MODE", render_mode)
+    patch(saved, run_trials, "PACING", pacing)
+    patch(saved, run_trials, "DROP_MESSAGE", False) ## the frames of the benchmark are not paced on the screen
+    patch(saved, run_trials, "GAZE_CONTINGENT", bool(gaze_rate))
+    patch(saved, run_trials, "SACCADE_DETECTION", saccades)
+    if gaze_rate:
+        gaze = dummy.SaccadeModel(gaze_rate, duration = 10., center = (0, 0), targets = [(0, 0)], seed = 0)
+        fixating = gaze.xy.copy() ## noise around (0, 0)
+        MyEyelink.setGazeSource(gaze)
+        ## a poll: from getNewestSample to the end of FixationCheck.stable
+        getNewestSample, stable = MyEyelink.getNewestSample, utils.FixationCheck.stable
+        def timedSample():
+            profiler.poll_start = clock()
+            return getNewestSample()
+        def timedStable(check):
+            result = stable(check)
+            profiler.polls.append(clock() - profiler.poll_start)
+            return result
+        MyEyelink.getNewestSample = timedSample
+        patch(saved, utils.FixationCheck, "stable", timedStable)
+
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key = pygame.K_SPACE, mod = 0, unicode = u" ")) ## instructions
+    try:
+        run_trials.run_trials(MyEnv, 0, nb_trials+1)
+    finally:
+        unpatch(saved)
+        os.remove(path_to_frames)
+    return profiler, MyEyelink
+
+def printStages(times):
+    print "%-8s"%"stage" + "".join("%9s"%("p%d"%p if p < 100 else "max") for p in PERCENTILES) + "%9s   (ms per frame)"%"mean"
+    for k, stage in enumerate(STAGES):
+        print "%-8s"%stage + "".join("%9.3f"%v for v in np.percentile(times[:, k], PERCENTILES)) + "%9.3f"%times[:, k].mean()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Per-frame cost of the stages of run_trials.drawCondition, on the SDL dummy video driver.")
+    parser.add_argument("-n", "--trials", type = int, default = 30, help = "number of trials")
+    parser.add_argument("-m", "--render-mode", choices = RENDER_MODES + ["all"], default = run_trials.RENDER_MODE,
+                        help = "all: the same trials in the 3 render modes, with a comparison of the frame times")
+    parser.add_argument("-t", "--trial-type", type = int, choices = [0, 1, 2], help = "only trials of this type")
+    parser.add_argument("-p", "--pacing", choices = ["scheduler", "busy_loop"], default = run_trials.PACING)
+    parser.add_argument("-g", "--gaze-rate", type = int, default = 0, choices = [0, 500, 1000, 2000],
+                        help = "gaze-contingent start on a synthetic gaze streamed at this rate (Hz)")
+    parser.add_argument("-s", "--saccades", action = "store_true", help = "online detection of a synthetic saccade to S1 (needs -g)")
+    parser.add_argument("-o", "--output", help = "saves the times of the frames (ms, frames x STAGES) in a .npy file")
+    args = parser.parse_args()
+
+    if args.saccades and not args.gaze_rate:
+        parser.error("-s needs a synthetic gaze (-g RATE)")
+    if args.render_mode == "all" and args.gaze_rate:
+        parser.error("-m all compares the rendering, without the synthetic gaze (-g)")
+    if args.render_mode == "all":
+        frames = {}
+        for mode in RENDER_MODES:
+            profiler, tracker = runBenchmark(args.trials, mode, args.pacing, trial_type = args.trial_type)
+            frames[mode] = profiler.measured()
+            print "render mode: %s, %d frames measured"%(mode, len(frames[mode]))
+            printStages(frames[mode])
+            print
+            if args.output:
+                np.save(os.path.splitext(args.output)[0] + "-%s.npy"%mode, frames[mode])
+        print "%-8s"%"mode" + "%9s%9s%9s%9s   (ms per frame, fill+draw+flip)"%("mean", "median", "p95", "max")
+        for mode in RENDER_MODES:
+            render = frames[mode][:, [STAGES.index("fill"), STAGES.index("draw"), STAGES.index("flip")]].sum(axis = 1)
+            print "%-8s"%mode + "%9.3f%9.3f%9.3f%9.3f"%(render.mean(), np.median(render), np.percentile(render, 95), render.max())
+        return
+    profiler, tracker = runBenchmark(args.trials, args.render_mode, args.pacing, args.gaze_rate, args.saccades, args.trial_type)
+    times = profiler.measured()
+    print "%d trials, %d frames measured, %d messages, render mode: %s, pacing: %s"%(args.trials, len(times),
+          len(tracker.messages), args.render_mode, args.pacing)
+    printStages(times)
+    if profiler.polls:
+        polls = np.array(profiler.polls) * 1000.
+        print "%-8s"%"poll" + "".join("%9.3f"%v for v in np.percentile(polls, PERCENTILES)) + "%9.3f"%polls.mean() + \
+              "   (%d polls of the gaze at %d Hz)"%(len(polls), args.gaze_rate)
+    if args.saccades:
+        latencies = run_trials.SACCADE_DETECTOR.table()[:, 3]
+        print "%d saccades detected in %d trials, latency of the detection (ms): median %.1f, max %.1f"%(len(latencies),
+              args.trials, np.median(latencies) if len(latencies) else np.nan, latencies.max() if len(latencies) else np.nan)
+    if args.output:
+        np.save(args.output, times)
+
+if __name__ == '__main__':
+    main()
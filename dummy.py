@@ -8,19 +8,34 @@
 # Copyright:   (c) c1248317 2014
 # Licence:     <your licence>
 #-------------------------------------------------------------------------------
+import os
+import timeit
+import numpy as np
 import pygame
 from pylink import *
 
+MISSING = -32768.0 ## gaze of the samples without data (blinks), as MISSING_DATA of pylink
+
 class DummyEyeLink():
-    def __init__(self):
+    def __init__(self, gaze = None):
         pygame.init()
         self.mysample = Sample()
         self.brk = False
         self.escape = False
+        self.gaze = None
+        if gaze is not None:
+            self.setGazeSource(gaze)
+
+    def setGazeSource(self, gaze):
+        ''' the samples are taken from a GazeSource (ReplayGaze, SaccadeModel) instead of the mouse,
+        its stream starts now. None goes back to the mouse. '''
+        self.gaze = gaze
+        if gaze is not None:
+            gaze.start()
 
     def update(self):
         for event in pygame.event.get():
-            if event.type == pygame.MOUSEMOTION:
+            if event.type == pygame.MOUSEMOTION and self.gaze is None:
                 self.mysample.myeye.setGaze(pygame.mouse.get_pos())
             if event.type == pygame.KEYDOWN:
                 k = pygame.key.get_pressed()
@@ -96,12 +111,22 @@ class DummyEyeLink():
         pass
     def getLastButtonPress(self):
         return (0,0,0,0,0)
+    def trackerTime(self):
+        return currentTime() ## the samples of the gaze sources are on this clock
     def getNewestSample(self):
+        if self.gaze is not None:
+            self.mysample.time, gaze = self.gaze.newest()
+            self.mysample.myeye.setGaze(gaze)
+        else:
+            self.mysample.time = currentTime() ## the mouse: a new sample at each poll
         return self.mysample
 
 class Sample():
     def __init__(self):
         self.myeye = Eye()
+        self.time = 0
+    def getTime(self):
+        return self.time
     def getRightEye(self):
         return self.myeye
     def getLeftEye(self):
@@ -116,8 +141,66 @@ class Eye():
         self.x = 0
         self.y = 0
     def getGaze(self):
-        print self.x, self.y
         return (self.x, self.y)
     def setGaze(self, vector):
         self.x, self.y = vector[0], vector[1]
 
+
+class GazeSource():
+    ''' stream of gaze samples (x, y in pixels) at rate Hz, looped: the newest sample is the one of the time
+    elapsed since start(), its time is on the clock of pylink (currentTime) '''
+    def __init__(self, x, y, rate = 1000):
+        self.rate = float(rate)
+        self.xy = np.column_stack((x, y))
+        self.xy[np.isnan(self.xy).any(axis = 1)] = MISSING
+        self.start()
+
+    def start(self):
+        self.start_time = currentTime()
+        self.start_clock = timeit.default_timer()
+
+    def newest(self):
+        ''' (time in ms, (x, y)) of the newest sample '''
+        index = int((timeit.default_timer() - self.start_clock) * self.rate)
+        return self.start_time + index * 1000. / self.rate, self.xy[index % len(self.xy)]
+
+class ReplayGaze(GazeSource):
+    ''' replays the gaze of a recorded session: a datamat (.npy, 11 columns, xp and yp in the columns 6 and 7),
+    a directory of columns (asc_utils.saveColumns) or an array of (x, y) (.npy).
+    The samples recorded at recorded_rate are resampled at rate (nearest sample). '''
+    def __init__(self, path, rate = 1000, recorded_rate = 1000):
+        if os.path.isdir(path):
+            import asc_utils
+            trials, data = asc_utils.loadColumns(path, ["xp", "yp"])
+            x, y = data["xp"], data["yp"]
+        else:
+            data = np.load(path, mmap_mode = "r")
+            x, y = (data[:, 6], data[:, 7]) if data.shape[1] == 11 else (data[:, 0], data[:, 1])
+        index = (np.arange(int(len(x) * float(rate) / recorded_rate)) * (float(recorded_rate) / rate)).astype(int)
+        GazeSource.__init__(self, np.asarray(x, dtype = float)[index], np.asarray(y, dtype = float)[index], rate)
+
+class SaccadeModel(GazeSource):
+    ''' synthetic gaze: fixations alternating between the center and the targets (pixels, chosen at random),
+    lasting fixation = (min, max) ms, joined by saccades of the main sequence (duration = 2.2 ms/deg * amplitude + 21 ms)
+    with a minimum-jerk profile, plus a gaussian noise of noise pixels. The default targets are 8 positions at
+    13.5 deg around the center. '''
+    def __init__(self, rate = 1000, duration = 60., center = (640, 512), targets = None, fixation = (150, 600),
+                 pixels_per_degree = 44., noise = 0.5, seed = None):
+        rng = np.random.RandomState(seed)
+        if targets is None:
+            angles = np.radians(np.arange(0, 360, 45))
+            targets = np.asarray(center) + 13.5 * pixels_per_degree * np.column_stack((np.cos(angles), -np.sin(angles)))
+        targets = np.asarray(targets, dtype = float)
+        ## fixation k on points[k], then saccade k to points[k+1]: enough of them to last duration
+        nb = int(duration * 1000. / fixation[0]) + 2
+        points = np.zeros((nb, 2)) + center
+        points[1::2] = targets[rng.randint(len(targets), size = len(points[1::2]))]
+        fixation_durations = rng.uniform(fixation[0], fixation[1], nb - 1)
+        saccade_durations = 2.2 * np.hypot(*(points[1:] - points[:-1]).T) / pixels_per_degree + 21
+        starts = np.concatenate(([0], np.cumsum(fixation_durations + saccade_durations)[:-1]))
+        t = np.arange(int(duration * rate)) * 1000. / rate
+        k = np.searchsorted(starts, t, side = "right") - 1
+        tau = np.clip((t - starts[k] - fixation_durations[k]) / saccade_durations[k], 0, 1)
+        xy = points[k] + (points[k+1] - points[k]) * (tau**3 * (10 - 15*tau + 6*tau**2))[:, np.newaxis]
+        xy += rng.normal(0, noise, xy.shape)
+        GazeSource.__init__(self, xy[:, 0], xy[:, 1], rate)
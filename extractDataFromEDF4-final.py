@@ -1,101 +1,98 @@
 import time
 #tick = time.time()
-import numpy as np
-import re
 import os
 import glob
 import ntpath
+import argparse
+import multiprocessing
+import asc_utils
 
 
-os.chdir(os.path.dirname(os.path.realpath(__file__)))
 path_input = "raw_file/"
 path_output = "numpy_file/"
 
-list_names = []
-list_files = glob.glob(path_input+"*.asc")
-for p in list_files:
-    list_names.append(ntpath.basename(p).split(".")[0]+"-np")
-    
-print list_files
-print list_names
+def printProgress(count, total, result):
+    path_to_file, nb_samples, nb_trials, duration, signature, error = result
+    if error is not None:
+        print "[%d/%d] %s: FAILED after %.4f second, %s"%(count, total, ntpath.basename(path_to_file), duration, error)
+    else:
+        print "[%d/%d] %s: %d samples, %d trials, done in %.4f second"%(count, total, ntpath.basename(path_to_file), nb_samples, nb_trials, duration)
+
+def recordResult(manifest, failed, result):
+    ''' only the files converted are added to the manifest, the other ones will be converted again next time '''
+    if result[-1] is None:
+        manifest[result[0]] = result[-2]
+        asc_utils.saveManifest(path_output, manifest)
+    else:
+        failed.append(result[0])
+
+def main():
+    parser = argparse.ArgumentParser(description = "Convert the ASC files of %s into numpy files in %s."%(path_input, path_output))
+    parser.add_argument("-j", "--jobs", type = int, default = 1,
+                        help = "number of worker processes (0 for one per CPU), implies --batch if more than 1")
+    parser.add_argument("-b", "--batch", action = "store_true",
+                        help = "non-interactive mode: do not wait for a key press after each file")
+    parser.add_argument("--format", choices = ["matrix", "columns"], default = "matrix",
+                        help = "matrix: one N x 11 .npy file per session; columns: one directory per session with a table of trials and one memory-mappable .npy file per sample column")
+    parser.add_argument("-c", "--chunk-size", type = int, default = 0,
+                        help = "convert the files by blocks of CHUNK_SIZE samples, written directly on disk (bounded memory for long sessions); 0 to convert in memory")
+    parser.add_argument("-f", "--force", action = "store_true",
+                        help = "convert all the files, even those which are up to date in the manifest")
+    args = parser.parse_args()
+    batch = args.batch or args.jobs != 1
+
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    suffix = "-col" if args.format == "columns" else "-np.npy"
+    list_names = []
+    list_files = glob.glob(path_input+"*.asc")
+    for p in list_files:
+        list_names.append(ntpath.basename(p).split(".")[0]+suffix)
+
+    print list_files
+    print list_names
+
+    tasks = [(path_to_file, path_output+name, args.format, args.chunk_size) for path_to_file, name in zip(list_files, list_names)]
+    manifest = asc_utils.loadManifest(path_output)
+    if not args.force:
+        nb_files = len(tasks)
+        tasks = [task for task in tasks if not asc_utils.isUpToDate(manifest, *task[0:2])]
+        print "%d files up to date, %d to convert (use --force to convert everything)"%(nb_files - len(tasks), len(tasks))
+        asc_utils.saveManifest(path_output, manifest) ## keeps the refreshed modification times
+    nb_jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+    nb_jobs = min(nb_jobs, max(len(tasks), 1))
 
-#raw_input("stop...")
-
-for path_to_file, name in zip(list_files, list_names):
-    ## open EDF file.
-    fixation_ON = []
-    stimuli_ON = []
-    distractor_OFF = []
-    end_times = []
-    trial_id = []
-    target_ecc = []
-    target_dir = []
-    trial_type = []
-    digit_lines = []
-    print "open and read EDF file..." + name
-    with open(path_to_file) as f:
-        for line in f:
-            if re.match("\d+", line):
-                digit_lines.append(line.split())
-
-            elif "Fixation ON" in line:
-                fixation_ON.append(map(int, re.findall("\d+", line))[0])
-            elif "Fixation OFF" in line:
-                stimuli_ON.append(map(int, re.findall("\d+", line))[0])
-            elif "Distractor OFF" in line:
-                distractor_OFF.append(map(int, re.findall("\d+", line))[0])
-            elif "END" in line:
-                end_times.append(map(int, re.findall("\d+", line))[0])
-            elif "TRIALID" in line:
-                t = np.array(line.split("[")[1].split(), dtype=float) # barbarian way
-                #print t
-                trial_id.append(int(t[0]+1)) ## strat from 1 and not from 0
-                trial_type.append(int(t[1]))
-                target_ecc.append(t[2])
-                target_dir.append(t[3])
-
-    print "conversion to Numpy Array"
-    par = np.vstack((trial_id, trial_type, fixation_ON, stimuli_ON, distractor_OFF, end_times, target_ecc, target_dir)).T
-    a = np.array(digit_lines)
-    print "Replacement ... by NaN:"
-    a = a[:, 0:6]
-    a[a=="."] = np.nan
-    real_time = a.astype(float)
-
-    # trial id, type trial, stimuli ON, Target ecc, target direction, time, xp, yp, ps, xv, yv.  (11 columns)
-    datamat = np.zeros((real_time.shape[0],11))
-    datamat[:, 5:11] = real_time
-    
-
-    # create matrix of data
-    end = [0]
-    start = 0
     tick = time.time()
-    print "Matrix creation"
-    for index, p in enumerate(par): ## read index trial find in the EDF file.
-        print "\r trial ID:", index,
-        start = end[0] ## we start the search from the end of the previous 
-        #print real_time[:,0] == p[-3]
-        end = np.where(real_time[:,0] == (p[-3]-1))[0] ## we end the search at the end of the current trial
-        #print start, end
-        select = real_time[start:end,0] >= p[2]
-        #print select
-        #last_row 
-        datamat[start:end,0:5][select,:] = np.tile(p[0:5], (np.sum(select),1) )
-        datamat[start:end, 5][select] -= p[2] ## fixation_ON is the time zero
-
-    tock = time.time() - tick
-    print "saving..."
-    raw_input("Done in %.4f second"%tock)
-    np.save(path_output+name+".npy", datamat)
-
-    print "end"
-
+    failed = []
+    if nb_jobs == 1:
+        for count, task in enumerate(tasks):
+            print "open and read EDF file..." + task[0]
+            result = asc_utils.convertTask(task)
+            printProgress(count+1, len(tasks), result)
+            recordResult(manifest, failed, result)
+            if not batch:
+                raw_input("Press Enter to continue...")
+    else:
+        print "Conversion of %d files with %d processes"%(len(tasks), nb_jobs)
+        pool = multiprocessing.Pool(nb_jobs)
+        try:
+            for count, result in enumerate(pool.imap_unordered(asc_utils.convertTask, tasks)):
+                printProgress(count+1, len(tasks), result)
+                recordResult(manifest, failed, result)
+        finally:
+            pool.close()
+            pool.join()
+
+    print "end: %d files in %.4f second"%(len(tasks), time.time() - tick)
+    if failed:
+        print "%d files could not be converted:"%len(failed), ", ".join(ntpath.basename(p) for p in failed)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
 
 
 # import matplotlib.pyplot as plt
 # select = (datamat[:,0] == 0)
 # plt.scatter(datamat[select, 6], datamat[select, 7])
 # plt.show()
-
-
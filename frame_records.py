@@ -0,0 +1,33 @@
+import numpy as np
+
+## Frame intervals of the sessions (framerate/FPS-<block>-<subject>.bin), written by run_trials and read by
+## analyse_framerate: numpy only, so that the analysis doesn't need pylink nor pygame
+FRAME_RECORD_DTYPE = [("trial", "<i4"), ("frame", "<i4"), ("interval", "<f4")] ## interval in ms
+
+class FrameRecorder():
+    ''' Intervals between the frames of the session, tagged with the trial and the index of the frame.
+    They are kept in preallocated arrays (no allocation in the frame loop) and appended
+    to the binary file path (FRAME_RECORD_DTYPE records) by flush, at the breaks and at the end of the session. '''
+    def __init__(self, path, capacity = 2**18):
+        self.path = path
+        self.capacity = capacity
+        self.trials = np.zeros(capacity, dtype = np.int32)
+        self.frames = np.zeros(capacity, dtype = np.int32)
+        self.intervals = np.zeros(capacity, dtype = np.float32)
+        self.count = 0
+        open(path, "wb").close() ## a new file for each session
+
+    def record(self, trial, frame, interval):
+        if self.count == self.capacity: ## a break every few hundred trials shouldn't let this happen
+            self.flush()
+        self.trials[self.count] = trial
+        self.frames[self.count] = frame
+        self.intervals[self.count] = interval
+        self.count += 1
+
+    def flush(self):
+        records = np.zeros(self.count, dtype = FRAME_RECORD_DTYPE)
+        records["trial"], records["frame"], records["interval"] = self.trials[:self.count], self.frames[:self.count], self.intervals[:self.count]
+        with open(self.path, "ab") as f:
+            records.tofile(f)
+        self.count = 0
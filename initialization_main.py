@@ -31,16 +31,41 @@
 #
 
 
+import sys
+import time
+import timeit
+import __builtin__
+
+## Startup time: each import of the modules below is timed (cumulative, with the imports it triggers),
+## the breakdown is printed in debug mode, like python -X importtime
+launch_time = time.time()
+IMPORT_TIMES = [] ## (depth, module, seconds), in the order the imports end
+_import = __builtin__.__import__
+_import_depth = [0]
+def timedImport(name, globals = {}, locals = {}, fromlist = [], level = -1):
+    if name in sys.modules:
+        return _import(name, globals, locals, fromlist, level)
+    start = timeit.default_timer()
+    _import_depth[0] += 1
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        _import_depth[0] -= 1
+        if not name: ## from . import a, b
+            name = "%s.(%s)"%((globals or {}).get("__package__") or "", ", ".join(fromlist or ()))
+        IMPORT_TIMES.append((_import_depth[0], name, timeit.default_timer() - start))
+__builtin__.__import__ = timedImport
+
 #from pylink import *
 import pylink
 from pygame import *
 import utils
 import gc
-import sys
 import run_trials
 import dummy
-import time
+import time ## after pygame.*, which has its own time
 
+__builtin__.__import__ = _import
 start_time = time.time()
 
 print time.strftime("Program started at %H:%M:%S", time.localtime(start_time))
@@ -49,7 +74,16 @@ import os
 os.environ['SDL_VIDEO_CENTERED']='1'
 init()
 
+def printImportTimes(threshold = 0.01):
+    ''' imports of the startup which took more than threshold seconds, nested by depth '''
+    print "Imports of the startup (%.2f s), cumulative time in ms:"%(start_time - launch_time)
+    for depth, name, seconds in IMPORT_TIMES:
+        if seconds >= threshold:
+            print "%9.1f | %s%s"%(seconds*1000., "  "*depth, name)
+
 def main(debug_mode):
+    if debug_mode:
+        printImportTimes()
     MyMonitor = utils.Monitor("labo-Tom-PC",1280,1024, distance = 72, width_cm = 36.6)
     print "Degrees per pixel: ", MyMonitor.degreesperpixel
     if debug_mode:
@@ -63,7 +97,7 @@ def main(debug_mode):
     START = 0 ## from what line of the table we should start
     NB_TRIALS = 800
     BREAK_INTERVAL = 200 #200 ## display the take-a-break screen every XX trials
-    FRAME_RATE = 100.0 ## not used for now
+    FRAME_RATE = 100.0 ## refresh rate of the screen, used to convert the durations of the table (given at 100 Hz)
     calib_type = "HV13" ## try HV13 for 13 dots
     file_asking = raw_input("Start with: [N]ew file, [O]pen a file, [T]est file: \n")
 
@@ -94,15 +128,22 @@ def main(debug_mode):
         MyEyelink = dummy.DummyEyeLink()
         MyMonitor.setFPSControl(FRAME_RATE) ## force 100 Hz during office-test ## switch to zero when running the experiment
 
+    MyMonitor.setFrameRate(FRAME_RATE)
+
     ## Initializes the graphics
     display.init()
     mouse.set_visible(False)
 
     ## do a new display surface
     if full_screen:
-        display.set_mode((MyMonitor.w, MyMonitor.h), FULLSCREEN |DOUBLEBUF | HWSURFACE,32)
+        flags = FULLSCREEN |DOUBLEBUF | HWSURFACE
     else:
-        display.set_mode((MyMonitor.w, MyMonitor.h), NOFRAME |DOUBLEBUF,32)
+        flags = NOFRAME |DOUBLEBUF
+    if run_trials.RENDER_MODE == "dirty":
+        ## display.update(rects) can't be used on a double buffer, and it doesn't wait for the vsync
+        flags &= ~(DOUBLEBUF | HWSURFACE)
+        MyMonitor.setFPSControl(FRAME_RATE)
+    display.set_mode((MyMonitor.w, MyMonitor.h), flags,32)
 
     surf = display.get_surface()
     MyEnv = utils.Environment(surf, MyMonitor,
@@ -123,13 +164,16 @@ def main(debug_mode):
     MyEyelink.sendCommand("screen_pixel_coords =  0 0 %d %d" %(surf.get_rect().w, surf.get_rect().h))
     MyEyelink.sendMessage("DISPLAY_COORDS  0 0 %d %d" %(surf.get_rect().w, surf.get_rect().h))
 
+    name_fps = ".\\framerate\\FPS-" + "-".join(info[-2:])
+    run_trials.FRAME_RECORDER = utils.FrameRecorder("%s.bin"%name_fps)
+
     error = 0
     stop_time = time.time()
     print time.strftime("Experiment started at %H:%M:%S", time.localtime(stop_time))
     try:
         if(MyEyelink.isConnected() and not MyEyelink.breakPressed()):
             print "Let's run the trials"
-            error, saveFrames = run_trials.run_trials(MyEnv, START, BREAK_INTERVAL)
+            error = run_trials.run_trials(MyEnv, START, BREAK_INTERVAL)
     except Exception, e:
         print "Caught:", e
     finally: # whatever waht happened it will save the data
@@ -153,13 +197,11 @@ def main(debug_mode):
         print time.strftime("Duration of %H:%M:%S", time.localtime(stop_time-start_time))
 
         MyEyelink.close()
-        #print saveFrames
-        import numpy as np
-        name_fps = ".\\framerate\\FPS-" + "-".join(info[-2:])
+        run_trials.FRAME_RECORDER.flush()
         try:
-            np.savetxt("%s.txt"%name_fps, saveFrames)
+            run_trials.saveTimingReport(run_trials.FRAME_RECORDER.path)
         except Exception, e:
-            print "No record of Framerate returned, exception:", e
+            print "No timing report, exception:", e
         print "Saved and closed!"
 
 
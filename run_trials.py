@@ -7,6 +7,7 @@
 #from pylink import *
 import pylink
 import gc
+import os
 
 import pygame
 from pygame import display
@@ -25,7 +26,7 @@ BACKGROUND = utils.BACKGROUND
 
 ## Everything will be passed by the main module
 FPS_CONTROL = 0
-FRAME_INTERVALS = []
+FRAME_RECORDER = None ## utils.FrameRecorder of the session
 MyEyelink = None
 MyMonitor = None
 MySurface = None
@@ -38,6 +39,9 @@ fixation = None
 text = None
 fps = None
 clock = pygame.time.Clock()
+## "scheduler": the frames are paced by utils.FrameScheduler (sleeps most of the frame), "busy_loop": clock.tick_busy_loop
+PACING = "scheduler"
+SCHEDULER = None
 
 
 def initStimuliX(MyEnv):
@@ -69,6 +73,7 @@ def end_trial():
     '''Ends recording: adds 100 msec of data to catch final events'''
     MySurface.fill((0,0,0))
     ## should clear the screen!!!!!!!!!!!
+    MESSAGE_QUEUE.flush() ## the messages of the trial are written before the end of the recording
     pylink.endRealTimeMode();
     pylink.pumpDelay(100);
     MyEyelink.stopRecording();
@@ -84,72 +89,187 @@ def giveParametersToEyeTracker(par): ## not needed here but can be personnalized
     MyEyelink.sendMessage("!V TRIAL_VAR distractor_dir  %d" %par[5] )
     MyEyelink.sendMessage("!V TRIAL_VAR distance  %d" %par[6] )
 
-def updateStimuliFromParameters(par):
-    ''' | ntrial | trial type | Target ecc. | Target dir. | Distractor ecc. | Distractor dir. | T-D Distance
-    trial type: 0 for control (center vertical saccades),
-                1 for single,
-                2 for double, '''
-
-    global stimulus1, stimulus2, text, fixation
-
-    if (par[1] == 2):
-        """ double condition """
-        stimulus2.drawn = True
-        #distractor.setFillColor(distractor.color1)
-        stim1_pos = utils.polToCart(par[2], par[3])
-        fixation_pos = np.array((0,0))
-        stim2_pos = utils.polToCart(par[4], par[5])
-
-        if stim1_pos[0] < 0:
-            offset = -stim1_pos
-        else: ## not very useful...
-            offset = -stim1_pos
-        offset[1] = 0
-        print offset, stim1_pos
-
-        fixation.setPosDegCart(fixation_pos+offset)
-        stimulus2.setPosDegCart(stim2_pos+offset)
-        stimulus1.setPosDegCart(stim1_pos+offset)
-
-    elif (par[1] == 1):
-        """single stimulus condition"""
-        stimulus2.drawn = False
-                #distractor.setFillColor(distractor.color1)
-        stim1_pos = utils.polToCart(par[2], par[3])
-        fixation_pos = np.array((0,0))
-        stim2_pos = utils.polToCart(par[4], par[5])
-
-        if stim1_pos[0] < 0:
-            offset = -stim1_pos ## getByName("stim1")
-        else:
-            offset = -stim1_pos
-        offset[1] = 0
-        print offset, stim1_pos
-
-        fixation.setPosDegCart(fixation_pos+offset)
-        stimulus2.setPosDegCart(stim2_pos+offset)
-        stimulus1.setPosDegCart(stim1_pos+offset)
-
-    elif (par[1] == 0):
-        """ control condition """
-        stimulus2.drawn = False
-        stimulus1.setPosDegCart((0, utils.polToCart(par[2], par[3])[1]))
-        fixation.setPosDegCart((0, - utils.polToCart(par[2], par[3])[1]))
+def computeStimuliPositions(table, start = 0):
+    ''' Positions of the fixation, S1 and S2 of every trial of the table, computed in one pass before the session.
+    | ntrial | trial type | Target ecc. | Target dir. | Distractor ecc. | Distractor dir. | T-D Distance
+    trial type: 0 for control (center vertical saccades): S1 above or below the center, the fixation on the opposite side,
+                1 for single, 2 for double: shifted horizontally to put S1 on the vertical meridian (S2 only drawn in double)
+    S2 keeps the position of the previous trial in the control condition (not drawn, but given by its messages),
+    from the position (0,0) at the start.
+    Returns a dictionary: "<shape>_deg", "<shape>_polar" (lists) and "<shape>_pixels" (lists of int) of each shape
+    (fixation, stimulus1, stimulus2), and "stimulus2_drawn". '''
+    n = len(table)
+    stim1_pos = utils.polToCart(table[:, 2], table[:, 3]).T
+    stim2_pos = utils.polToCart(table[:, 4], table[:, 5]).T
+    offset = np.column_stack((-stim1_pos[:, 0], np.zeros(n)))
+    positions = {"fixation": np.zeros((n, 2)) + offset, "stimulus1": stim1_pos + offset, "stimulus2": stim2_pos + offset}
+
+    control = table[:, 1] == 0
+    positions["stimulus1"][control] = np.column_stack((np.zeros(control.sum()), stim1_pos[control, 1]))
+    positions["fixation"][control] = np.column_stack((np.zeros(control.sum()), - stim1_pos[control, 1]))
+    ## S2 of the control trials: position of the last trial run before (forward fill from the start)
+    placed = ~control & (np.arange(n) >= start)
+    last = np.maximum.accumulate(np.where(placed, np.arange(n), -1))
+    stim2 = np.vstack((np.zeros((1, 2)), positions["stimulus2"])) ## row 0: position at the creation of the shape
+    positions["stimulus2"] = stim2[last + 1]
+
+    result = {"stimulus2_drawn": (table[:, 1] == 2).tolist()}
+    for name, pos in positions.items():
+        result[name + "_deg"] = pos.tolist()
+        result[name + "_polar"] = utils.cartToPol(pos[:, 0], pos[:, 1]).T.tolist()
+        result[name + "_pixels"] = MyMonitor.degToPixelsCenteredArray(pos).tolist()
+    return result
+
+def placeStimuli(index):
+    ''' places the stimuli of the trial at the line index of the table (positions computed by computeStimuliPositions) '''
+    for name, shape in (("fixation", fixation), ("stimulus1", stimulus1), ("stimulus2", stimulus2)):
+        shape.setPosComputed(POSITIONS[name + "_deg"][index], POSITIONS[name + "_polar"][index], POSITIONS[name + "_pixels"][index])
+    stimulus2.drawn = POSITIONS["stimulus2_drawn"][index]
 
 
 def sign(n):
     ''' take 0 or 1 as input, give -1 for 0 and 1 for 1'''
     return n*2-1
 
-def drawCondition(FIX_duration, GAP_duration, S1_duration, S2_duration):
-    S2_OFF = FIX_duration + GAP_duration + S1_duration + S2_duration ## could be replace with a cumsum of a line
+## Display list of a trial: which shape is drawn and which message is sent on each frame
+SHOW_NOTHING, SHOW_FIXATION, SHOW_S1, SHOW_S2 = range(4)
+NO_EVENT, EVENT_FIXATION_ON, EVENT_FIXATION_OFF, EVENT_S1_ON, EVENT_S1OFF_S2ON, EVENT_S2_OFF, EVENT_PRESSED, EVENT_FRAME_DROP, EVENT_FIXATED, EVENT_SACCADE = range(10)
+PHASE_NAMES = ("blank", "fixation", "S1", "S2") ## indexed by SHOW_*
+SYNC_EVENTS = (EVENT_FIXATION_ON, EVENT_S1_ON, EVENT_S1OFF_S2ON) ## events which restart the SYNCTIME
+SCHEDULES = []
+POSITIONS = {} ## positions of the stimuli of every trial, see computeStimuliPositions
+MESSAGES = {}
+## the messages of the events are sent by a background thread (utils.MessageQueue), created by run_trials
+MESSAGE_QUEUE = None
+## "fill": the screen is filled and the shape drawn on each frame
+## "cache": the screen of each phase is pre-rendered during the inter-trial interval, a frame is a single blit;
+##          a full screen blit costs more than a fill and a small blit, and 4 screens are allocated per trial
+## "dirty": only the rectangles of the shapes which appear or disappear are redrawn and updated (display.update),
+##          needs a display without DOUBLEBUF and a frame pacing by FPS_CONTROL (see initialization_main)
+RENDER_MODE = "fill"
+FRAME_CACHE = []
+## A frame is dropped when its interval is longer than DROP_FACTOR periods of the screen
+## (the frames 0 and 1 are not checked: they include the inter-trial interval and the key press)
+DROP_FACTOR = 1.5
+DROP_MESSAGE = True ## sends a "FRAME DROP" message to the tracker
+REPEAT_DROPPED = False ## runs again a trial which dropped frames, at most MAX_REPEATS times
+MAX_REPEATS = 3
+DROPPED = 0 ## number of frames dropped by the last trial
+## Gaze-contingent start: the trial goes on after FIXATION_STABLE ms of gaze within FIXATION_WINDOW degrees
+## of the fixation point, instead of waiting for a key press (a key press still starts the trial)
+GAZE_CONTINGENT = False
+FIXATION_WINDOW = 2.0
+FIXATION_STABLE = 200
+FIXATION_CHECK = None ## utils.FixationCheck, created by run_trials
+## Online detection of the first saccade after the S1 onset, from the newest sample of each frame:
+## a "SACCADE DETECTED" message is sent at the detection, the latencies are in the timing report
+SACCADE_DETECTION = False
+SACCADE_DETECTOR = None ## saccade_utils.OnlineSaccadeDetector, created by run_trials if SACCADE_DETECTION
+
+def compileSchedule(FIX_duration, GAP_duration, S1_duration, S2_duration, frame_rate = 100.0):
+    ''' Returns the lists (shapes, events) giving for each frame of the trial the shape to draw (SHOW_*)
+    and the message to send (EVENT_*). The durations are in frames at 100 Hz, they are converted to frame_rate.
+    The masks are applied from the lowest to the highest priority, as the if/elif ladder used to do on each frame. '''
+    FIX_duration, GAP_duration, S1_duration, S2_duration = [int(round(d*frame_rate/100.0)) for d in (FIX_duration, GAP_duration, S1_duration, S2_duration)]
+    S2_OFF = FIX_duration + GAP_duration + S1_duration + S2_duration
     S1S2_OFFON = FIX_duration + GAP_duration + S1_duration
     S1_ON = FIX_duration + GAP_duration
     FIX_OFF = FIX_duration
+    frames = np.arange(S2_OFF)
+    shapes = np.zeros(S2_OFF, dtype = np.int8)
+    events = np.zeros(S2_OFF, dtype = np.int8)
+    branches = [(frames == (S2_OFF-1), SHOW_NOTHING, EVENT_S2_OFF),
+                ((frames > S1S2_OFFON) & (frames < (S2_OFF-1)), SHOW_S2, NO_EVENT),
+                (frames == S1S2_OFFON, SHOW_S2, EVENT_S1OFF_S2ON),
+                ((frames > S1_ON) & (frames < S1S2_OFFON), SHOW_S1, NO_EVENT),
+                (frames == S1_ON, SHOW_S1, EVENT_S1_ON),
+                (frames == FIX_OFF, SHOW_NOTHING, EVENT_FIXATION_OFF),
+                (frames < FIX_OFF, SHOW_FIXATION, NO_EVENT),
+                (frames == 1, SHOW_FIXATION, EVENT_FIXATION_ON)]
+    for select, shape, event in branches:
+        shapes[select] = shape
+        events[select] = event
+    return shapes.tolist(), events.tolist() ## lists are faster to index than arrays in the frame loop
+
+def compileSchedules(table, frame_rate = 100.0):
+    ''' display lists of all the trials of the table (fixation, gap, S1 and S2 durations in par[-5:-1]) '''
+    return [compileSchedule(*(list(par[-5:-1].astype(int)) + [frame_rate])) for par in table]
+
+def trialMessages():
+    ''' Messages of the current trial (without their SYNCTIME), formatted once the stimuli are placed '''
+    def text(name, shape):
+        return "STIMULUS %s %.3f %.3f"%(name, shape.getPolarPos(0), shape.getPolarPos(1))
+    return {EVENT_FIXATION_ON: [text("Fixation ON", fixation)],
+            EVENT_FIXATION_OFF: [text("Fixation OFF", fixation)],
+            EVENT_S1_ON: [text("S1 ON", stimulus1)],
+            EVENT_S1OFF_S2ON: [text("S1 OFF", stimulus1), text("S2 ON", stimulus2)],
+            EVENT_S2_OFF: [text("S2 OFF", stimulus2)],
+            EVENT_PRESSED: [text("Fixation PRESSED", fixation)],
+            EVENT_FIXATED: [text("Fixation FIXATED", fixation)],
+            EVENT_FRAME_DROP: ["FRAME DROP"],
+            EVENT_SACCADE: ["SACCADE DETECTED"]}
+
+def buildFrameCache():
+    ''' full screen surfaces of the current trial, indexed by SHOW_*: background alone, fixation, S1, S2 '''
+    cache = []
+    for shape in (None, fixation, stimulus1, stimulus2):
+        frame = MySurface.copy()
+        frame.fill(BACKGROUND)
+        if shape is not None:
+            shape.draw(frame)
+        cache.append(frame)
+    return cache
+
+def updateDirty(display_list, previous, current):
+    ''' dirty-rectangle mode: erases the shape of the previous frame and draws the one of the current frame (SHOW_*).
+    Returns the rectangles of the screen to update, an empty list when nothing changed.
+    previous is None on the first frame of the trial: the whole screen is cleared. '''
+    if previous is None:
+        MySurface.fill(BACKGROUND)
+        rects = [MySurface.get_rect()]
+    elif current == previous:
+        return []
+    else:
+        rects = []
+        if display_list[previous] is not None:
+            MySurface.fill(BACKGROUND, display_list[previous].rect)
+            rects.append(display_list[previous].rect)
+    if display_list[current] is not None:
+        display_list[current].draw()
+        rects.append(display_list[current].rect)
+    return rects
+
+def waitFixation():
+    ''' Gaze-contingent start of the trial: polls the newest sample of the tracker once per frame until the
+    gaze is stable in the fixation window (EVENT_FIXATED). A key press starts the trial as without the check
+    (EVENT_PRESSED), the key stays in the queue for the frame loop (Ctrl+Q, Ctrl+R). '''
+    FIXATION_CHECK.reset(fixation.pos)
+    while True:
+        if pygame.event.peek(pygame.KEYDOWN):
+            return EVENT_PRESSED
+        if dummy:
+            MyEyelink.update()
+        FIXATION_CHECK.add(MyEyelink.getNewestSample())
+        if FIXATION_CHECK.stable():
+            return EVENT_FIXATED
+        SCHEDULER.idle() ## no flip: a tick would take the wait for the vsync
+
+def drawCondition(schedule, trial):
+    global DROPPED
+    shapes, events = schedule
+    drop_limit = DROP_FACTOR * 1000.0/MyMonitor.frame_rate
+    DROPPED = 0
+    display_list = (None, fixation, stimulus1, stimulus2) ## indexed by SHOW_*
+    cached = RENDER_MODE == "cache"
+    dirty = RENDER_MODE == "dirty"
+    previous = None ## shape of the previous frame in dirty mode
+    detecting = False ## from the S1 onset to the detection of the saccade
+    if SACCADE_DETECTION:
+        SACCADE_DETECTOR.reset(trial)
     MyEyelink.flushKeybuttons(0)
     buttons =(0, 0);
     # Loop of realtime
-    for frameN in xrange(S2_OFF):
+    for frameN in xrange(len(shapes)):
         for event in pygame.event.get():
             if event.type == pygame.KEYDOWN:
                     k = pygame.key.get_pressed()
@@ -162,7 +282,13 @@ def drawCondition(FIX_duration, GAP_duration, S1_duration, S2_duration):
                         end_trial();
                         print "Crtl + R pressed: repeat trial"
                         return pylink.REPEAT_TRIAL
-        MySurface.fill(BACKGROUND)
+        if cached:
+            MySurface.blit(FRAME_CACHE[shapes[frameN]], (0, 0))
+        elif dirty:
+            rects = updateDirty(display_list, previous, shapes[frameN])
+            previous = shapes[frameN]
+        else:
+            MySurface.fill(BACKGROUND)
         # check input (should be in a function)
         if dummy:
             MyEyelink.update()
@@ -173,36 +299,47 @@ def drawCondition(FIX_duration, GAP_duration, S1_duration, S2_duration):
             return error
 
         # here you draw
-        if frameN == 1:
-            startTime = pylink.currentTime()
-            fixation.draw()
-            MyEyelink.sendMessage("STIMULUS Fixation ON %.3f %.3f SYNCTIME %d"%(fixation.getPolarPos(0), fixation.getPolarPos(1), pylink.currentTime()-startTime));
-            while (pygame.event.wait().type != pygame.KEYDOWN): pass
-            MyEyelink.sendMessage("STIMULUS Fixation PRESSED %.3f %.3f SYNCTIME %d"%(fixation.getPolarPos(0), fixation.getPolarPos(1), pylink.currentTime()-startTime));
-        elif frameN < FIX_OFF:
-            fixation.draw()
-        elif frameN == FIX_OFF:
-            MyEyelink.sendMessage("STIMULUS Fixation OFF %.3f %.3f SYNCTIME %d"%(fixation.getPolarPos(0), fixation.getPolarPos(1), pylink.currentTime()-startTime));
-        elif frameN == S1_ON:
-            startTime = pylink.currentTime()
-            stimulus1.draw()
-            MyEyelink.sendMessage("STIMULUS S1 ON %.3f %.3f SYNCTIME %d"%(stimulus1.getPolarPos(0), stimulus1.getPolarPos(1), pylink.currentTime()-startTime));
-        elif frameN > S1_ON and frameN < S1S2_OFFON:
-            stimulus1.draw()
-        elif frameN == S1S2_OFFON:
-            startTime = pylink.currentTime()
-            stimulus2.draw()
-            MyEyelink.sendMessage("STIMULUS S1 OFF %.3f %.3f SYNCTIME %d"%(stimulus1.getPolarPos(0), stimulus1.getPolarPos(1), pylink.currentTime()-startTime));
-            MyEyelink.sendMessage("STIMULUS S2 ON %.3f %.3f SYNCTIME %d"%(stimulus2.getPolarPos(0), stimulus2.getPolarPos(1), pylink.currentTime()-startTime));
-        elif frameN > S1S2_OFFON and frameN < (S2_OFF-1):
-            stimulus2.draw()
-        elif frameN == (S2_OFF-1):
-            MyEyelink.sendMessage("STIMULUS S2 OFF %.3f %.3f SYNCTIME %d"%(stimulus2.getPolarPos(0), stimulus2.getPolarPos(1), pylink.currentTime()-startTime));
+        shape = display_list[shapes[frameN]]
+        if shape is not None and not (cached or dirty):
+            shape.draw()
+        trial_event = events[frameN]
+        if trial_event:
+            MESSAGE_QUEUE.put(frameN, trial_event, pylink.currentTime())
+            if trial_event == EVENT_FIXATION_ON:
+                if GAZE_CONTINGENT:
+                    start_event = waitFixation()
+                else:
+                    while (pygame.event.wait().type != pygame.KEYDOWN): pass
+                    start_event = EVENT_PRESSED
+                MESSAGE_QUEUE.put(frameN, start_event, pylink.currentTime())
+            elif trial_event == EVENT_S1_ON:
+                detecting = SACCADE_DETECTION
+        if detecting and SACCADE_DETECTOR.update(MyEyelink.getNewestSample(), MyEyelink.trackerTime()):
+            MESSAGE_QUEUE.put(frameN, EVENT_SACCADE, pylink.currentTime())
+            detecting = False
         if dummy:
+            if dirty:
+                MySurface.fill(BACKGROUND, fps.rect)
+                rects += [text.rect, fps.rect.copy()]
             text.draw()
-            utils.drawFPS(fps, clock)
-        display.flip()
-        FRAME_INTERVALS.append(clock.tick_busy_loop(FPS_CONTROL))
+            utils.drawFPS(fps, SCHEDULER if PACING == "scheduler" else clock)
+            if dirty:
+                rects.append(fps.rect)
+        if PACING == "scheduler":
+            SCHEDULER.flipping()
+        if dirty:
+            display.update(rects)
+        else:
+            display.flip()
+        if PACING == "scheduler":
+            interval = SCHEDULER.tick()
+        else:
+            interval = clock.tick_busy_loop(FPS_CONTROL)
+        FRAME_RECORDER.record(trial, frameN, interval)
+        if interval > drop_limit and frameN > 1:
+            DROPPED += 1
+            if DROP_MESSAGE:
+                MESSAGE_QUEUE.put(frameN, EVENT_FRAME_DROP, pylink.currentTime())
 
     end_trial();
 
@@ -215,8 +352,8 @@ def drawCondition(FIX_duration, GAP_duration, S1_duration, S2_duration):
 
 
 
-def do_trial(par):
-    '''Does the simple trial'''
+def do_trial(par, index):
+    '''Does the simple trial (index: line of the trial in the table, to find its display list)'''
     id_number = str(par[0])+" TRIAL_TYPE "+str(par[1])+" CODE_TYPE "+str(par[-1]) ## par contains the trial parameters
     ##This supplies the title at the bottom of the eyetracker display
 #       message ="record_status_message 'Trial %s'"%id_number
@@ -233,7 +370,12 @@ def do_trial(par):
     ##This TRIAL_VAR command specifies a trial variable and value for the given trial.
     ##Send one message for each pair of trial condition variable and its corresponding value.
     ## You can put this in a function
-    updateStimuliFromParameters(par)
+    global MESSAGES, FRAME_CACHE
+    placeStimuli(index)
+    MESSAGES = trialMessages()
+    MESSAGE_QUEUE.messages = MESSAGES
+    if RENDER_MODE == "cache":
+        FRAME_CACHE = buildFrameCache()
     #giveParametersToEyeTracker(par)
 
     ## you can do a drifcorrection if you want
@@ -255,7 +397,8 @@ def do_trial(par):
     ## the fixation duration if now at par[-5]
     ## the gap duration is used by drawCondition
     ## (change from previous program: par[-3:] to par[-5:-1])
-    ret_value = drawCondition(*par[-5:-1].astype(int));
+    ## the durations par[-5:-1] are compiled in SCHEDULES at the beginning of run_trials
+    ret_value = drawCondition(SCHEDULES[index], int(par[0]));
     pylink.endRealTimeMode();
     gc.enable();
     return ret_value;
@@ -269,10 +412,19 @@ def run_trials(MyEnv, start, break_interval):
 
     ''' Returns a successful trial with 0, aborting experiment with ABORT_EXPT (3); It also handles
     the case of re-running a trial. '''
-    global MySurface, MyMonitor, MyEyelink, MyTable, MyInfo, FPS_CONTROL
+    global MySurface, MyMonitor, MyEyelink, MyTable, MyInfo, FPS_CONTROL, SCHEDULES, POSITIONS, MESSAGE_QUEUE, SCHEDULER, FIXATION_CHECK, SACCADE_DETECTOR
     MySurface, MyMonitor, MyEyelink, MyTable, MyInfo = MyEnv.getDetails()
     # Give the screen reference to Stimuli, and initialize them:
     FPS_CONTROL = MyMonitor.fps_control
+    SCHEDULER = utils.FrameScheduler(MyMonitor.frame_rate, FPS_CONTROL)
+    # Compile the display list of every trial before the session starts:
+    SCHEDULES = compileSchedules(MyTable, MyMonitor.frame_rate)
+    POSITIONS = computeStimuliPositions(MyTable, start)
+    MESSAGE_QUEUE = utils.MessageQueue(MyEyelink, SYNC_EVENTS)
+    FIXATION_CHECK = utils.FixationCheck(MyMonitor.degToPixels(FIXATION_WINDOW), FIXATION_STABLE)
+    if SACCADE_DETECTION:
+        import saccade_utils ## with the offline analysis (asc_utils): not imported at the startup of the experiment
+        SACCADE_DETECTOR = saccade_utils.OnlineSaccadeDetector(scale = MyMonitor.degreesperpixel)
     # Give the screen reference to Stimuli, and initialize them:
     initStimuliO(MyEnv)
     utils.displayInstruction(MyEnv, "instructions-same.txt")
@@ -289,20 +441,27 @@ def run_trials(MyEnv, start, break_interval):
         if(MyEyelink.isConnected() ==0 or MyEyelink.breakPressed()): break;
 
         if i % break_interval == 0 and i>0:
+            FRAME_RECORDER.flush()
             s = "Part %d on %d achieved !"%(i / break_interval, nb_trials/break_interval )
             event = utils.displayInstruction(MyEnv, "waiting_message.txt", additional_text = s)
             if event.key == pygame.K_r:
                 event = utils.runCalibration(MyEnv)
             if event.key == pygame.K_ESCAPE:
                 MyEyelink.sendMessage("EXPERIMENT ABORTED")
-                return pylink.ABORT_EXPT, FRAME_INTERVALS;
+                return pylink.ABORT_EXPT;
 
+        repeats = 0
         while 1:
-            ret_value = do_trial(trial)
+            ret_value = do_trial(trial, start+i)
             pylink.endRealTimeMode()
 
             if (ret_value == pylink.TRIAL_OK):
                 MyEyelink.sendMessage("TRIAL OK");
+                if REPEAT_DROPPED and DROPPED and repeats < MAX_REPEATS:
+                    repeats += 1
+                    MyEyelink.sendMessage("TRIAL REPEATED after %d frame drops"%DROPPED);
+                    print "TRIAL %s REPEATED after %d frame drops"%(str(i), DROPPED)
+                    continue;
                 break;
             elif (ret_value == pylink.SKIP_TRIAL):
                 MyEyelink.sendMessage("TRIAL %s SKIPPED"%str(i));
@@ -311,7 +470,7 @@ def run_trials(MyEnv, start, break_interval):
             elif (ret_value == pylink.ABORT_EXPT):
                 MyEyelink.sendMessage("EXP. ABORTED AT TRIAL %s"%str(i));
                 print "EXP. ABORTED AT TRIAL %s"%str(i)
-                return pylink.ABORT_EXPT, FRAME_INTERVALS;
+                return pylink.ABORT_EXPT;
             elif (ret_value == pylink.REPEAT_TRIAL):
                 utils.runCalibration(MyEnv)
                 MyEyelink.sendMessage("TRIAL REPEATED after Calibration");
@@ -319,5 +478,55 @@ def run_trials(MyEnv, start, break_interval):
                 MyEyelink.sendMessage("TRIAL ERROR")
                 break;
 
-    return 0, FRAME_INTERVALS;
-
+    return 0;
+
+def timingReport(path_to_frames):
+    ''' Per-trial summary of the frame intervals written by the FrameRecorder of the session:
+    one row per run of a trial (a repeated trial has several attempts), frames 0 and 1 excluded (see DROP_FACTOR).
+    Returns a table | trial id | attempt | frames | mean | max | jitter (sd) | drops | drops in each phase (PHASE_NAMES) | '''
+    records = np.fromfile(path_to_frames, dtype = utils.FRAME_RECORD_DTYPE)
+    header = "trial attempt frames mean max jitter drops " + " ".join("drops_%s"%name for name in PHASE_NAMES)
+    if len(records) == 0:
+        return np.zeros((0, 7 + len(PHASE_NAMES))), header
+    trials, frames = records["trial"], records["frame"]
+    intervals = records["interval"].astype(float)
+    n = len(records)
+    ## a run starts on a new trial id or when the frames start again from 0
+    first = np.concatenate(([True], (trials[1:] != trials[:-1]) | (frames[1:] == 0)))
+    starts = np.flatnonzero(first)
+    new_trial = np.concatenate(([True], trials[1:][first[1:]] != trials[starts[:-1]]))
+    attempt = np.arange(len(starts)) - np.maximum.accumulate(np.where(new_trial, np.arange(len(starts)), 0))
+
+    ## phase (SHOW_*) of each frame, from the display list of the trial
+    line_of = dict((int(t), l) for l, t in enumerate(MyTable[:, 0]))
+    lengths = np.diff(np.concatenate((starts, [n])))
+    phases = np.concatenate([np.asarray(SCHEDULES[line_of[t]][0])[np.minimum(frames[s:s+k], len(SCHEDULES[line_of[t]][0])-1)]
+                             for t, s, k in zip(trials[starts], starts, lengths)])
+
+    valid = frames > 1
+    dropped = (valid & (intervals > DROP_FACTOR * 1000.0/MyMonitor.frame_rate)).astype(int)
+    count = np.add.reduceat(valid.astype(float), starts)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mean = np.add.reduceat(np.where(valid, intervals, 0), starts) / count
+        jitter = np.sqrt(np.maximum(np.add.reduceat(np.where(valid, intervals**2, 0), starts) / count - mean**2, 0))
+    longest = np.maximum.reduceat(np.where(valid, intervals, -np.inf), starts)
+    longest[count == 0] = np.nan
+    drops_by_phase = np.add.reduceat(dropped[:, np.newaxis] * (phases[:, np.newaxis] == np.arange(len(PHASE_NAMES))), starts)
+    table = np.column_stack((trials[starts], attempt, lengths, mean, longest, jitter, np.add.reduceat(dropped, starts), drops_by_phase))
+    return table, header
+
+def saveTimingReport(path_to_frames):
+    ''' writes the timingReport of the session next to the frame intervals (<name>-trials.txt) and prints its summary '''
+    table, header = timingReport(path_to_frames)
+    path_to_report = os.path.splitext(path_to_frames)[0] + "-trials.txt"
+    np.savetxt(path_to_report, table, fmt = ["%d", "%d", "%d", "%.3f", "%.3f", "%.3f", "%d"] + ["%d"]*len(PHASE_NAMES), header = header)
+    dropping = table[:, 6] > 0
+    print "Timing: %d trials run, %d with frame drops (%d frames dropped: %s), report in %s"%(len(table), dropping.sum(), table[:, 6].sum(),
+          ", ".join("%d in %s"%(n, name) for n, name in zip(table[:, 7:].sum(0), PHASE_NAMES)), path_to_report)
+    if SACCADE_DETECTOR is not None and SACCADE_DETECTOR.count:
+        saccades = SACCADE_DETECTOR.table()
+        path_to_saccades = os.path.splitext(path_to_frames)[0] + "-saccades.txt"
+        np.savetxt(path_to_saccades, saccades, fmt = ["%d", "%.1f", "%.1f", "%.1f"], header = "trial onset detection latency")
+        print "Online saccades: %d detected, latency of the detection: median %.1f ms, 95%% %.1f ms, max %.1f ms, report in %s"%(
+              len(saccades), np.median(saccades[:, 3]), np.percentile(saccades[:, 3], 95), saccades[:, 3].max(), path_to_saccades)
+    return table
@@ -0,0 +1,150 @@
+import numpy as np
+import asc_utils
+
+## Saccade detection on the samples extracted by extractDataFromEDF4-final.py
+## The thresholds are the ones of the EyeLink parser (cognitive configuration), the velocities
+## are the xv, yv columns written by edf2asc -vel (degrees/second).
+VELOCITY_THRESHOLD = 30. ## deg/s
+ACCELERATION_THRESHOLD = 8000. ## deg/s2
+MIN_DURATION = 10 ## ms
+FIRST_SACCADE_DTYPE = [("trial", np.int32), ("type", np.int16), ("code", np.int32),
+                       ("latency", np.float32), ("duration", np.float32), ## ms, latency from the onset of the first stimulus
+                       ("start_x", np.float32), ("start_y", np.float32), ("end_x", np.float32), ("end_y", np.float32),
+                       ("amplitude", np.float32), ("direction", np.float32), ("peak_velocity", np.float32),
+                       ("deviation", np.float32), ("curvature", np.float32)]
+
+def detectFirstSaccades(times, xp, yp, xv, yv, trials, velocity_threshold = VELOCITY_THRESHOLD,
+                        acceleration_threshold = ACCELERATION_THRESHOLD, min_duration = MIN_DURATION, scale = 1.0):
+    ''' First saccade of every trial after the onset of the first stimulus, for a whole session at once.
+    times, xp, yp, xv, yv: sample columns of the datamat (the fixation ON is the time zero within the trials)
+    trials: table of trials of the session (asc_utils.TRIAL_DTYPE)
+    scale: size of a pixel in the unit wanted for the amplitude and the deviation (e.g. Monitor.degreesperpixel)
+    Returns a table with one row per trial (NaN if no saccade was found):
+        latency, duration, start/end position (pixels), amplitude, direction (degrees, with the y axis
+        of the screen), peak velocity, deviation (maximal signed distance of the trajectory from the
+        straight line, positive on the right of the movement as seen on the screen) and curvature (deviation/amplitude).
+    '''
+    times = np.asarray(times, dtype = float)
+    xp, yp = np.asarray(xp, dtype = float), np.asarray(yp, dtype = float)
+    speed = np.hypot(np.asarray(xv, dtype = float), np.asarray(yv, dtype = float))
+    acceleration = np.zeros(speed.shape)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        acceleration[1:] = np.abs(np.diff(speed)) / (np.diff(times)/1000.)
+        moving = (speed > velocity_threshold) | (acceleration > acceleration_threshold)
+
+    ## rows of each trial from the onset of the first stimulus (times are relative to the fixation ON)
+    onset = (trials["stimuli_on"] - trials["fixation_on"]).astype(float)
+    rows, lengths = asc_utils.segmentRows(trials["start"], trials["end"])
+    segment = np.zeros(times.shape[0], dtype = int) - 1
+    segment[rows] = np.repeat(np.arange(len(trials)), lengths)
+    segment[rows[times[rows] < np.repeat(onset, lengths)]] = -1
+    moving &= segment >= 0
+
+    ## onsets and offsets of the movements, a movement can't run across two trials
+    previous = np.concatenate(([False], moving[:-1])) & (np.concatenate(([-1], segment[:-1])) == segment)
+    following = np.concatenate((moving[1:], [False])) & (np.concatenate((segment[1:], [-1])) == segment)
+    on = np.flatnonzero(moving & ~previous)
+    off = np.flatnonzero(moving & ~following)
+    keep = (times[off] - times[on]) >= min_duration
+    on, off = on[keep], off[keep]
+
+    ## first saccade of each trial (the saccades are sorted by row)
+    trial_index, first = np.unique(segment[on], return_index = True)
+    on, off = on[first], off[first]
+
+    result = np.zeros(len(trials), dtype = FIRST_SACCADE_DTYPE)
+    for field in ["trial", "type", "code"]:
+        result[field] = trials["id" if field == "trial" else field]
+    for field, dtype in FIRST_SACCADE_DTYPE[3:]:
+        result[field] = np.nan
+    if len(on) == 0:
+        return result
+
+    dx, dy = xp[off] - xp[on], yp[off] - yp[on]
+    amplitude = np.hypot(dx, dy)
+    saccade_rows, saccade_lengths = asc_utils.segmentRows(on, off+1)
+    bounds = np.concatenate(([0], np.cumsum(saccade_lengths)[:-1]))
+    ## signed distance of each sample from the line start -> end of its saccade
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        distance = ((yp[saccade_rows] - np.repeat(yp[on], saccade_lengths))*np.repeat(dx, saccade_lengths)
+                    - (xp[saccade_rows] - np.repeat(xp[on], saccade_lengths))*np.repeat(dy, saccade_lengths)) / np.repeat(amplitude, saccade_lengths)
+    highest = np.fmax.reduceat(distance, bounds)
+    lowest = np.fmin.reduceat(distance, bounds)
+    deviation = np.where(np.abs(highest) >= np.abs(lowest), highest, lowest)
+
+    result["latency"][trial_index] = times[on] - onset[trial_index]
+    result["duration"][trial_index] = times[off] - times[on]
+    result["start_x"][trial_index], result["start_y"][trial_index] = xp[on], yp[on]
+    result["end_x"][trial_index], result["end_y"][trial_index] = xp[off], yp[off]
+    result["amplitude"][trial_index] = amplitude * scale
+    result["direction"][trial_index] = np.degrees(np.arctan2(dy, dx))
+    result["peak_velocity"][trial_index] = np.fmax.reduceat(speed[saccade_rows], bounds)
+    result["deviation"][trial_index] = deviation * scale
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        result["curvature"][trial_index] = deviation / amplitude
+    return result
+
+def firstSaccades(eyedata, **kwargs):
+    ''' detectFirstSaccades on a session opened with asc_utils.EyeData (datamat or columns) '''
+    if isinstance(eyedata.data, dict):
+        columns = [eyedata.data[name] for name in ["time", "xp", "yp", "xv", "yv"]]
+    else:
+        columns = [eyedata.data[:, i] for i in [5, 6, 7, 9, 10]]
+    return detectFirstSaccades(*(columns + [eyedata.trials]), **kwargs)
+
+class OnlineSaccadeDetector():
+    ''' Onset of the first saccade of a trial, detected during the trial from the samples of the link
+    (getNewestSample of pylink.EyeLink or dummy.DummyEyeLink), in constant time per sample (update).
+    The velocity is the distance between two successive samples over their interval (polled once per frame,
+    the samples are a few ms apart at the tracker rates), scale: size of a pixel in degrees (Monitor.degreesperpixel).
+    The onset is the first of min_samples successive samples above velocity_threshold, a missing sample (blink)
+    restarts the detection. The detections are kept (trial, onset, detection time, latency in ms) for the report. '''
+    def __init__(self, velocity_threshold = VELOCITY_THRESHOLD, min_samples = 2, scale = 1.0, capacity = 4096):
+        self.velocity_threshold = velocity_threshold
+        self.min_samples = min_samples
+        self.scale = scale
+        self.capacity = capacity
+        self.detections = np.zeros((capacity, 4)) ## trial | onset | detection | latency
+        self.count = 0
+        self.reset(0)
+
+    def reset(self, trial):
+        ''' starts the detection of the first saccade of a trial '''
+        self.trial = trial
+        self.detected = False
+        self.last_time = None
+        self.last_x, self.last_y = 0., 0.
+        self.run = 0 ## number of successive samples above the threshold
+        self.onset = 0
+
+    def update(self, sample, now):
+        ''' adds the newest sample of the link (a sample already seen is ignored), now: time of the tracker (ms),
+        on the clock of the samples (EyeLink.trackerTime, not pylink.currentTime of the display PC).
+        Returns True when the saccade is detected (once per trial). '''
+        if self.detected or sample is None or sample.getTime() == self.last_time:
+            return False
+        time = sample.getTime()
+        eye = sample.getRightEye() if sample.isRightSample() else sample.getLeftEye()
+        x, y = eye.getGaze()
+        if x < -10000 or y < -10000: ## MISSING_DATA
+            self.last_time, self.run = None, 0
+            return False
+        if self.last_time is not None:
+            dt = (time - self.last_time) / 1000.
+            if ((x - self.last_x)**2 + (y - self.last_y)**2) * self.scale**2 > (self.velocity_threshold * dt)**2:
+                self.run += 1
+                if self.run == 1:
+                    self.onset = time
+            else:
+                self.run = 0
+        self.last_time, self.last_x, self.last_y = time, x, y
+        if self.run < self.min_samples:
+            return False
+        self.detected = True
+        self.detections[self.count % self.capacity] = (self.trial, self.onset, now, now - self.onset)
+        self.count += 1
+        return True
+
+    def table(self):
+        ''' detections of the session (the capacity last ones): | trial | onset | detection | latency | '''
+        return self.detections[:min(self.count, self.capacity)]
@@ -0,0 +1,143 @@
+#-------------------------------------------------------------------------------
+# Purpose:     checks of asc_utils on small ASC fixtures, in the older format
+#              (TRIALID [...], Distractor OFF) and in the format written by the
+#              current run_trials (TRIALID <n> TRIAL_TYPE <t> CODE_TYPE <c>,
+#              offsets before the messages, no Distractor OFF).
+#
+# usage: python test_asc_utils.py (or pytest)
+#-------------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+import numpy as np
+
+import asc_utils
+
+OLDER_FORMAT = """** CONVERTED FROM OLD.EDF
+MSG\t1000 TRIALID [0 2 13.5 150 -1 -1 -1 80 20 35 35 1213
+START\t1000 \tLEFT\tSAMPLES\tEVENTS
+1000\t 640.0\t 512.0\t 1000.0\t 0.0\t 0.0\t.....
+MSG\t1001 STIMULUS Fixation ON 0.000 0.000 SYNCTIME 0
+1001\t 640.0\t 512.0\t 1000.0\t 0.0\t 0.0\t.....
+MSG\t1002 STIMULUS Fixation OFF 0.000 0.000 SYNCTIME 1
+1002\t 641.0\t 512.0\t 1000.0\t 0.0\t 0.0\t.....
+MSG\t1003 Distractor OFF
+1003\t 642.0\t 512.0\t 1000.0\t 0.0\t 0.0\t.....
+END\t1004 \tSAMPLES\tEVENTS\tRES\t 38.00\t 35.00
+"""
+
+## two runs of the trial 7 (repeated with Ctrl+R), the messages are sent with an offset by utils.MessageQueue
+CURRENT_FORMAT = """** CONVERTED FROM NEW.EDF
+MSG\t2000 TRIALID 7.0 TRIAL_TYPE 1.0 CODE_TYPE 1112.0
+START\t2000 \tLEFT\tSAMPLES\tEVENTS
+2000\t 640.0\t 512.0\t 1000.0\t 0.0\t 0.0\t.....
+MSG\t2003 2 STIMULUS Fixation ON 0.000 0.000 SYNCTIME 0
+2001\t 640.0\t 512.0\t 1000.0\t 0.0\t 0.0\t.....
+MSG\t2003 STIMULUS Fixation PRESSED 0.000 0.000 SYNCTIME 2
+END\t2004 \tSAMPLES\tEVENTS\tRES\t 38.00\t 35.00
+MSG\t2005 TRIAL_RESULT 0
+MSG\t3000 TRIALID 7.0 TRIAL_TYPE 1.0 CODE_TYPE 1112.0
+START\t3000 \tLEFT\tSAMPLES\tEVENTS
+3000\t 640.0\t 512.0\t 1000.0\t 0.0\t 0.0\t.....
+MSG\t3002 1 STIMULUS Fixation ON 0.000 0.000 SYNCTIME 0
+3001\t 640.0\t 512.0\t 1000.0\t 0.0\t 0.0\t.....
+MSG\t3003 STIMULUS Fixation FIXATED 0.000 0.000 SYNCTIME 2
+MSG\t3004 STIMULUS Fixation OFF 0.000 0.000 SYNCTIME 3
+3004\t 641.0\t 512.0\t 1000.0\t 0.0\t 0.0\t.....
+MSG\t3006 1 STIMULUS S1 ON 13.500 -30.000 SYNCTIME 0
+3006\t 700.0\t 480.0\t 1000.0\t 0.0\t 0.0\t.....
+MSG\t3007 SACCADE DETECTED SYNCTIME 2
+END\t3008 \tSAMPLES\tEVENTS\tRES\t 38.00\t 35.00
+MSG\t3009 TRIAL_RESULT 0
+"""
+
+def writeFixture(directory, name, text):
+    path = os.path.join(directory, name)
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+def checkParEqual(par, expected):
+    assert par.shape == expected.shape, (par.shape, expected.shape)
+    assert np.array_equal(np.isnan(par), np.isnan(expected)), par
+    assert np.allclose(par[~np.isnan(par)], expected[~np.isnan(expected)]), par
+
+def checkSameOutputs(output, other):
+    ''' the data and the tables of two conversions of a session are identical (NaN included) '''
+    if os.path.isdir(output):
+        names = sorted(os.listdir(output))
+        assert names == sorted(os.listdir(other)), names
+        paths = [(os.path.join(output, name), os.path.join(other, name)) for name in names]
+    else:
+        paths = [(output, other)] + [(asc_utils.tablePath(output, name), asc_utils.tablePath(other, name))
+                                     for name in ["trials", "events", "fixations", "saccades", "blinks"]]
+    for path, other_path in paths:
+        assert os.path.isfile(path) == os.path.isfile(other_path), path
+        if os.path.isfile(path):
+            a, b = np.load(path), np.load(other_path)
+            assert a.dtype == b.dtype and a.shape == b.shape, path
+            if a.dtype.names is None:
+                assert np.array_equal(np.isnan(a), np.isnan(b)) and np.array_equal(a[~np.isnan(a)], b[~np.isnan(b)]), path
+            else:
+                assert a.tobytes() == b.tobytes(), path
+
+def test_older_format():
+    directory = tempfile.mkdtemp()
+    try:
+        par, samples = asc_utils.readASC(writeFixture(directory, "old.asc", OLDER_FORMAT))
+        checkParEqual(par, np.array([[1, 2, 1001, 1002, 1003, 1004, 13.5, 150, 1213]], dtype = float))
+        assert samples.shape == (4, asc_utils.NB_SAMPLE_COLUMNS)
+        ## the chunked conversion gives the same files as the one in memory
+        path = os.path.join(directory, "old.asc")
+        for chunk_size in [0, 3]:
+            asc_utils.convertFile(path, os.path.join(directory, "old-%d.npy"%chunk_size), "matrix", chunk_size)
+            asc_utils.convertFile(path, os.path.join(directory, "old-%d"%chunk_size), "columns", chunk_size)
+        checkSameOutputs(os.path.join(directory, "old-0.npy"), os.path.join(directory, "old-3.npy"))
+        checkSameOutputs(os.path.join(directory, "old-0"), os.path.join(directory, "old-3"))
+    finally:
+        shutil.rmtree(directory)
+
+def test_current_format():
+    directory = tempfile.mkdtemp()
+    try:
+        path = writeFixture(directory, "new.asc", CURRENT_FORMAT)
+        events = []
+        par, samples = asc_utils.readASC(path, events)
+        nan = np.nan
+        checkParEqual(par, np.array([[7, 1, 2001, nan, nan, 2004, nan, nan, 1112],
+                                     [7, 1, 3001, 3004, nan, 3008, 13.5, -30, 1112]]))
+        kinds = [asc_utils.EVENT_KINDS[e[2]][0] for e in events]
+        assert kinds.count("FIXATION_FIXATED") == 1 and kinds.count("SACCADE_DETECTED") == 1, kinds
+        ## both conversions of a session without Distractor OFF
+        for chunk_size in [0, 2]:
+            output = os.path.join(directory, "new-%d.npy"%chunk_size)
+            asc_utils.convertFile(path, output, "matrix", chunk_size)
+            trials = asc_utils.loadTable(output, "trials")
+            assert np.isnan(trials["distractor_off"]).all()
+            assert list(trials["end_time"]) == [2004, 3008]
+            asc_utils.convertFile(path, os.path.join(directory, "new-%d"%chunk_size), "columns", chunk_size)
+        checkSameOutputs(os.path.join(directory, "new-0.npy"), os.path.join(directory, "new-2.npy"))
+        checkSameOutputs(os.path.join(directory, "new-0"), os.path.join(directory, "new-2"))
+    finally:
+        shutil.rmtree(directory)
+
+def test_repeated_trials():
+    directory = tempfile.mkdtemp()
+    try:
+        path = writeFixture(directory, "new.asc", CURRENT_FORMAT)
+        output = os.path.join(directory, "new.npy")
+        asc_utils.convertFile(path, output)
+        data = asc_utils.EyeData(output)
+        assert data.nbAttempts(7) == 2
+        assert list(data.trial(7)[:, 2]) == [3001] * 3 ## the last attempt, which went to the end
+        assert list(data.trial(7, 0)[:, 2]) == [2001]
+        assert len(data.trialsOfType(1)) == 1 and len(data.trialsOfType(1, all_attempts = True)) == 2
+        assert len(data.trialsOfCode(1112)) == 1
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    test_older_format()
+    test_current_format()
+    test_repeated_trials()
+    print "asc_utils: OK"
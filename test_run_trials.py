@@ -0,0 +1,93 @@
+#-------------------------------------------------------------------------------
+# Purpose:     checks of the functions of run_trials computed before the session,
+#              against the per-frame and per-trial code they replaced.
+#
+# usage: python test_run_trials.py (or pytest)
+#-------------------------------------------------------------------------------
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import itertools
+import numpy as np
+
+import utils
+import run_trials
+from run_trials import SHOW_NOTHING, SHOW_FIXATION, SHOW_S1, SHOW_S2, NO_EVENT, EVENT_FIXATION_ON, \
+                       EVENT_FIXATION_OFF, EVENT_S1_ON, EVENT_S1OFF_S2ON, EVENT_S2_OFF
+
+def ladderSchedule(FIX_duration, GAP_duration, S1_duration, S2_duration):
+    ''' shape and event of each frame, as the if/elif ladder of drawCondition chose them on each frame '''
+    S2_OFF = FIX_duration + GAP_duration + S1_duration + S2_duration
+    S1S2_OFFON = FIX_duration + GAP_duration + S1_duration
+    S1_ON = FIX_duration + GAP_duration
+    FIX_OFF = FIX_duration
+    shapes, events = [], []
+    for frameN in xrange(S2_OFF):
+        if frameN == 1:
+            shape, event = SHOW_FIXATION, EVENT_FIXATION_ON
+        elif frameN < FIX_OFF:
+            shape, event = SHOW_FIXATION, NO_EVENT
+        elif frameN == FIX_OFF:
+            shape, event = SHOW_NOTHING, EVENT_FIXATION_OFF
+        elif frameN == S1_ON:
+            shape, event = SHOW_S1, EVENT_S1_ON
+        elif frameN > S1_ON and frameN < S1S2_OFFON:
+            shape, event = SHOW_S1, NO_EVENT
+        elif frameN == S1S2_OFFON:
+            shape, event = SHOW_S2, EVENT_S1OFF_S2ON
+        elif frameN > S1S2_OFFON and frameN < (S2_OFF-1):
+            shape, event = SHOW_S2, NO_EVENT
+        elif frameN == (S2_OFF-1):
+            shape, event = SHOW_NOTHING, EVENT_S2_OFF
+        else:
+            shape, event = SHOW_NOTHING, NO_EVENT
+        shapes.append(shape)
+        events.append(event)
+    return shapes, events
+
+def test_compile_schedule():
+    ## short durations (phases of 0 to 3 frames, which overlap the special frames 1 and S2_OFF-1) and the ones of the table
+    durations = list(itertools.product(range(4), range(3), range(4), range(4))) + [(70, 20, 5, 40), (50, 0, 10, 0), (100, 30, 20, 15)]
+    for FIX_duration, GAP_duration, S1_duration, S2_duration in durations:
+        expected = ladderSchedule(FIX_duration, GAP_duration, S1_duration, S2_duration)
+        assert run_trials.compileSchedule(FIX_duration, GAP_duration, S1_duration, S2_duration) == expected, \
+               (FIX_duration, GAP_duration, S1_duration, S2_duration)
+
+def placedStimuli(table, start = 0):
+    ''' positions (deg) of the fixation, S1 and S2 and drawing of S2 in each trial from start, set trial after trial
+    as updateStimuliFromParameters did (S2 is not moved by the control trials) '''
+    stim2 = np.zeros(2)
+    placed = []
+    for par in table[start:]:
+        stim1_pos = utils.polToCart(par[2], par[3])
+        if par[1] == 0:
+            fixation_pos, stim1_pos = np.array((0, -stim1_pos[1])), np.array((0, stim1_pos[1]))
+        else:
+            offset = -stim1_pos
+            offset[1] = 0
+            fixation_pos, stim1_pos, stim2 = np.array((0, 0)) + offset, stim1_pos + offset, utils.polToCart(par[4], par[5]) + offset
+        placed.append((fixation_pos, stim1_pos, stim2, par[1] == 2))
+    return placed
+
+def test_compute_stimuli_positions():
+    run_trials.MyMonitor = utils.Monitor("labo-Tom-PC", 1280, 1024, distance = 72, width_cm = 36.6)
+    random = np.random.RandomState(0)
+    n = 3000
+    table = np.zeros((n, 12))
+    table[:, 0] = np.arange(1, n+1)
+    table[:, 1] = random.randint(0, 3, n)
+    table[:, 2], table[:, 4] = random.uniform(2, 15, n), random.uniform(2, 15, n)
+    table[:, 3], table[:, 5] = random.uniform(-180, 180, n), random.uniform(-180, 180, n)
+    table[:5, 1], table[1000:1005, 1] = 0, 0 ## control trials before the first placement of S2 (from start = 0 and 1000)
+    for start in [0, 1000]:
+        positions = run_trials.computeStimuliPositions(table, start)
+        for i, placed in enumerate(placedStimuli(table, start)):
+            for name, pos in zip(["fixation", "stimulus1", "stimulus2"], placed[:3]):
+                assert np.allclose(positions[name + "_deg"][start+i], pos, rtol = 0, atol = 1e-12), (name, start+i)
+                assert np.allclose(positions[name + "_polar"][start+i], utils.cartToPol(pos[0], pos[1]), rtol = 0, atol = 1e-9), (name, start+i)
+                assert tuple(positions[name + "_pixels"][start+i]) == run_trials.MyMonitor.degToPixelsCentered(pos), (name, start+i)
+            assert positions["stimulus2_drawn"][start+i] == placed[3]
+
+if __name__ == '__main__':
+    test_compile_schedule()
+    test_compute_stimuli_positions()
+    print "run_trials: OK"
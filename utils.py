@@ -4,7 +4,9 @@ import pylink
 from pygame import font
 import pygame
 import os, re, linecache
-import matplotlib.pyplot as plt
+import threading
+import timeit
+from frame_records import FRAME_RECORD_DTYPE, FrameRecorder
 from math import tan, radians
 
 ## Time and duration are in frames (100 frames == 1 seconds)
@@ -182,7 +184,13 @@ def printStatisticProportion(n_pos, total_trials, amount_of_test):
     if amount_of_test % n_pos != 0:
         print "Error: Can't test homogeneously ", n_pos, "configurations with", amount_of_test, "test trials"
 
+def pyplot():
+    ''' matplotlib.pyplot, imported by the first plot only: its import takes seconds and the experiment doesn't plot '''
+    import matplotlib.pyplot as plt
+    return plt
+
 def plot_trial_type(i, table):
+    plt = pyplot()
     cond = i
     select = (table[:,1] == cond) & ((table[:,3] < 90) & (table[:,3] > -90))
     T_x, T_y = polToCart(table[select,2], table[select,3])
@@ -215,6 +223,10 @@ def cartToPol(x, y):
     theta = np.degrees(np.arctan2(y,x))
     return np.array((r, theta))
 
+def roundHalfAway(x):
+    ''' rounds an array as round() does (half away from zero), np.round rounds half to even '''
+    return np.where(x >= 0, np.floor(x + 0.5), -np.floor(0.5 - x))
+
 def polToCart(r, theta):
     x = r*np.cos(np.radians(theta))
     y = r*np.sin(np.radians(theta))
@@ -276,6 +288,7 @@ def doRandomDotsTable(d_min, d_max, tol, number, r_min, r_max, res):
 
 
 def plot_figures(T_x, T_y, D_x, D_y, distances, h, w, bin_size):
+    plt = pyplot()
     plt.figure()
     plt.subplot(211)
     plt.scatter(T_x,T_y, color='red')
@@ -476,18 +489,29 @@ class Monitor():
         self.degreespercm = self.distance * abs(np.tan(np.radians(1.0))) * np.sign(1.0)
         self.degreesperpixel = self.degreespercm/self.pixelspercm
         self.fps_control = 0
+        self.frame_rate = 100.0 ## refresh rate of the screen, the durations of the table are in frames at 100 Hz
 
     def setFPSControl(self, n):
         self.fps_control = n
 
+    def setFrameRate(self, n):
+        self.frame_rate = n
+
     def degToPixelsCentered(self, pos_deg): ## to use for position: put the origin on the center of the screen
-        ''' deg is a position vector '''
+        ''' deg is a position vector, or an array of positions (N x 2, see degToPixelsCenteredArray) '''
+        if np.ndim(pos_deg) == 2:
+            return self.degToPixelsCenteredArray(pos_deg)
         cmx = self.degToCm(pos_deg[0])
         cmy = self.degToCm(pos_deg[1])
         return int(round(cmx*self.pixelspercm + self.w/2.0)), int(round(cmy*self.pixelspercm + self.h/2.0))
 
+    def degToPixelsCenteredArray(self, pos_deg):
+        ''' degToPixelsCentered for an array of positions (N x 2), returns an array of int (N x 2) '''
+        pixels = self.degToCm(np.asarray(pos_deg, dtype = float))*self.pixelspercm + self.size/2.0
+        return roundHalfAway(pixels).astype(int)
+
     def degToPixels(self, size_deg): ## to use for size
-        if type(size_deg) == int or type(size_deg) == float:
+        if np.ndim(size_deg) == 0: ## a number (python or numpy)
             return int(round(self.degToCm(size_deg)*self.pixelspercm))
         else:
             return np.round(self.degToCm(size_deg)*self.pixelspercm).astype(int)
@@ -560,6 +584,12 @@ class Shape():
     def setPos(self, pos):
         self.setPosDegCart(pos)
 
+    def setPosComputed(self, pos_deg, pos_polar, pos): ## position already converted (see run_trials.computeStimuliPositions)
+        self.pos_deg = pos_deg
+        self.pos_polar = pos_polar
+        self.pos = pos
+        self.rect.center = pos
+
     def getPolarPos(self, i):
         return self.pos_polar[i]
 
@@ -569,9 +599,9 @@ class Shape():
     def getPixelPos(self, i):
         return self.pos[i]
 
-    def draw(self):
+    def draw(self, surf = None): ## on the screen, or on another surface (e.g. a pre-rendered frame)
         if self.drawn:
-            self.mysurf.blit(self.texture, self.rect.topleft)
+            (surf or self.mysurf).blit(self.texture, self.rect.topleft)
 
 
 class Cross(Shape):
@@ -616,9 +646,9 @@ class TriangleUp(Shape):
         #pygame.polygon.lines(self.texture, self.fill_color, [(0,self.size[1]),(self.size[0]/2, 0),(self.size[0], self.size[1]), (0,self.size[1])], self.line_width)
         l = self.line_width
         pygame.draw.lines(self.texture, self.fill_color, True, [(l,self.size[1]-l),(self.size[0]/2, l),(self.size[0]-l, self.size[1]-l)], self.line_width)
-    def draw(self):
+    def draw(self, surf = None):
         pos = self.rect.topleft - self.gravityshift
-        self.mysurf.blit(self.texture, pos)
+        (surf or self.mysurf).blit(self.texture, pos)
 
 class TriangleDown(Shape):
     def __init__(self, MyEnvironment, size=(1,1), pos=(0,0), fill_color = (255,255,255), edge_color = (0,255,0), line_width = 1, units ='deg'):
@@ -632,9 +662,9 @@ class TriangleDown(Shape):
         l = self.line_width
         pygame.draw.lines(self.texture, self.fill_color, True, [(l,l), (self.size[0]/2, self.size[1]-l), (self.size[0]-l, l)], self.line_width)
 
-    def draw(self):
+    def draw(self, surf = None):
         pos = self.rect.topleft + self.gravityshift
-        self.mysurf.blit(self.texture, pos)
+        (surf or self.mysurf).blit(self.texture, pos)
 
 class CrossDiag(Shape):
     def __init__(self, MyEnvironment, size=(1,1), pos=(0,0), fill_color = (255,255,255), edge_color = (0,255,0), line_width = 1, units ='deg'):
@@ -723,6 +753,195 @@ def drawFPS(fps, clock):
     fps.setText(text)
     fps.draw()
 
+## records of the frame intervals written by FrameRecorder (little-endian, readable with np.fromfile)
+class FrameScheduler():
+    ''' Frame pacing without a busy loop, tick() is called after each display.flip().
+    fps_control > 0: the frames are paced at fps_control, tick sleeps until spin ms before the deadline
+                     and only spins for the end (as clock.tick_busy_loop, which spins for the whole frame).
+    fps_control == 0: display.flip waits for the vsync, tick sleeps until draw_margin ms before the next vsync,
+                      predicted from the flip times: the period of the screen is a running average (alpha)
+                      of the regular intervals, starting from frame_rate.
+                      The draw_margin is the percentile of the last draw times (from the end of tick to flipping(),
+                      called just before display.flip) plus spin ms. Until history frames are measured, and for
+                      the frames where the margin would be longer than the period, tick doesn't sleep at all
+                      (display.flip alone paces the frames, as clock.tick_busy_loop(0) did).
+    The intervals between the ticks are in ms (float). '''
+    def __init__(self, frame_rate, fps_control = 0, spin = 2.0, alpha = 0.05, percentile = 99, history = 128):
+        self.paced = fps_control > 0
+        self.period = 1000.0/(fps_control if self.paced else frame_rate)
+        self.spin = spin
+        self.alpha = alpha
+        self.percentile = percentile
+        self.draw_times = np.zeros(history) ## ms, ring buffer
+        self.nb_draws = 0
+        self.draw_margin = None ## no sleep until the draw times are known
+        self.wake = None ## end of the last tick
+        self.average = self.period ## running average of all the intervals, for get_fps
+        self.last = None
+        self.deadline = None ## time of the next frame when paced
+        self.timer = timeit.default_timer
+
+    def now(self):
+        return self.timer()*1000.0
+
+    def waitUntil(self, deadline, spin):
+        ''' sleeps (with a 1 ms resolution) until spin ms before the deadline, then spins until the deadline '''
+        remaining = deadline - spin - self.now()
+        if remaining >= 1:
+            pygame.time.wait(int(remaining))
+        while self.now() < deadline:
+            pass
+
+    def flipping(self):
+        ''' called just before display.flip: the time since the end of tick is the draw time of the frame.
+        The draw times longer than a period (first frame of a trial, key press) are not kept. '''
+        if self.wake is None:
+            return
+        draw_time = self.now() - self.wake
+        if draw_time < self.period:
+            self.draw_times[self.nb_draws % len(self.draw_times)] = draw_time
+            self.nb_draws += 1
+            if self.nb_draws % 32 == 0 and self.nb_draws >= len(self.draw_times):
+                self.draw_margin = np.percentile(self.draw_times, self.percentile) + self.spin
+
+    def idle(self):
+        ''' waits for about a period without a flip (e.g. polling the tracker between two frames): the prediction
+        of the vsync is left as it is, the next interval of tick includes the idle time '''
+        pygame.time.wait(int(self.period))
+        self.wake = None
+
+    def tick(self):
+        if self.paced and self.deadline is not None:
+            self.waitUntil(self.deadline, self.spin)
+        now = self.now()
+        interval = now - self.last if self.last is not None else 0.0
+        self.last = now
+        self.average += self.alpha*(interval - self.average)
+        if self.paced:
+            ## the deadlines stay on a grid of periods, a frame late by more than a period starts a new grid
+            self.deadline = self.deadline + self.period if self.deadline is not None else now + self.period
+            if self.deadline <= now:
+                self.deadline = now + self.period
+        else:
+            if abs(interval - self.period) < 0.25*self.period: ## a regular frame (no drop, no pause)
+                self.period += self.alpha*(interval - self.period)
+            if self.draw_margin is not None and self.draw_margin < self.period:
+                self.waitUntil(now + self.period - self.draw_margin, self.spin)
+        self.wake = self.now()
+        return interval
+
+    def get_fps(self): ## as pygame.time.Clock, for drawFPS
+        return 1000.0/self.average if self.average > 0 else 0.0
+
+class MessageQueue():
+    ''' Messages of the trial events sent to the tracker by a background thread.
+    The frame loop only records (frame, event, timestamp) in a preallocated ring buffer (put).
+    The thread sends the messages of the event (messages[event], a list of strings) as
+    "<offset> <message> SYNCTIME <ms>": the offset is the delay between the event and the sending,
+    the tracker removes it from the time of the message, which stays the time of the event.
+    sync_events: events which restart the SYNCTIME.
+    messages is the dict of the current trial: put keeps it with the event, so that an event still pending
+    when the next trial replaces self.messages is sent with the messages of its own trial.
+    An event whose messages can't be sent (link lost, no message for the event) is counted in errors and skipped,
+    the thread goes on with the next one. '''
+    def __init__(self, eyelink, sync_events = (), capacity = 256):
+        self.eyelink = eyelink
+        self.sync_events = sync_events
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity, 3), dtype = np.int64) ## frame | event | timestamp (ms, pylink.currentTime)
+        self.messages = {}
+        self.slot_messages = [None] * capacity ## self.messages at the put of the event of each slot of the buffer
+        self.written = 0 ## number of events recorded by put
+        self.sent = 0 ## number of events sent by the thread
+        self.sync_time = 0
+        self.errors = 0 ## events not sent (exception of sendMessage, or buffer full)
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, frame, event, timestamp):
+        if self.written - self.sent >= self.capacity and not self.flush(): ## full: shouldn't happen with a few events per trial
+            self.errors += 1
+            return
+        self.buffer[self.written % self.capacity] = (frame, event, timestamp)
+        self.slot_messages[self.written % self.capacity] = self.messages
+        with self.condition:
+            self.written += 1
+            self.condition.notify_all()
+
+    def flush(self, timeout = 2.0):
+        ''' waits until all the recorded events are sent, at most timeout seconds. Returns False if they are not. '''
+        deadline = timeit.default_timer() + timeout
+        with self.condition:
+            while self.sent < self.written:
+                remaining = deadline - timeit.default_timer()
+                if remaining <= 0:
+                    print "MessageQueue: %d events still not sent after %.1f s"%(self.written - self.sent, timeout)
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.sent == self.written:
+                    self.condition.wait()
+            frame, event, timestamp = self.buffer[self.sent % self.capacity]
+            messages = self.slot_messages[self.sent % self.capacity]
+            if event in self.sync_events:
+                self.sync_time = timestamp
+            try:
+                for message in messages[event]:
+                    self.eyelink.sendMessage("%d %s SYNCTIME %d"%(pylink.currentTime() - timestamp, message, timestamp - self.sync_time))
+            except Exception, e:
+                self.errors += 1
+                print "MessageQueue: event %d of the frame %d not sent:"%(event, frame), e
+            with self.condition:
+                self.sent += 1
+                self.condition.notify_all()
+
+class FixationCheck():
+    ''' Gaze-contingent fixation: the newest samples of the tracker are kept in a ring buffer (add), the fixation
+    is stable when the gaze stayed within radius pixels of the center for duration ms (stable).
+    The samples are kept at most every 2*duration/capacity ms, so that the buffer covers twice the duration
+    whatever the rate of the polling (once per frame, or faster than the tracker). '''
+    def __init__(self, radius, duration, capacity = 128):
+        self.radius2 = float(radius)**2
+        self.duration = duration
+        self.capacity = capacity
+        self.step = 2.0 * duration / capacity
+        self.buffer = np.zeros((capacity, 3)) ## time (ms) | x | y (pixels)
+        self.reset((0, 0))
+
+    def reset(self, center):
+        self.center = np.array(center, dtype = float)
+        self.buffer[:, 0] = -np.inf ## no sample
+        self.count = 0
+        self.last_time = None
+
+    def add(self, sample):
+        ''' adds a sample of the tracker (right eye if recorded), ignored if it is less than step ms after the last one '''
+        if sample is None or (self.last_time is not None and sample.getTime() - self.last_time < self.step):
+            return
+        eye = sample.getRightEye() if sample.isRightSample() else sample.getLeftEye()
+        x, y = eye.getGaze()
+        self.last_time = sample.getTime()
+        self.buffer[self.count % self.capacity] = (self.last_time, x, y)
+        self.count += 1
+
+    def stable(self):
+        ''' True if the gaze is in the window since duration ms: the samples since the last one outside
+        (or since the oldest of the buffer) go back that far '''
+        if self.count == 0:
+            return False
+        times = self.buffer[:, 0]
+        outside = ((self.buffer[:, 1:] - self.center)**2).sum(axis = 1) > self.radius2
+        if outside[(self.count-1) % self.capacity]:
+            return False
+        last_outside = times[outside].max() if outside.any() else -np.inf
+        return times[times > last_outside].min() <= self.last_time - self.duration
+
 def run_driftCorrection(MyEyelink):
     #The following does drift correction at the begin of each trial
     while 1:
@@ -795,6 +1014,10 @@ def displayTestScreen(MyEnv, ecc, n):
     tar_positions = np.linspace(0, 45, 9)[1:]
     tar_positions = np.hstack( (tar_positions, 180-tar_positions, -180+tar_positions, -tar_positions) )
     n_pos = len(tar_positions)
+    ## the 32 positions are converted at once, the frames only move the shapes
+    positions_deg = polToCart(ecc, tar_positions).T
+    positions = zip(positions_deg.tolist(), cartToPol(positions_deg[:,0], positions_deg[:,1]).T.tolist(),
+                    MyEnv.monitor.degToPixelsCenteredArray(positions_deg).tolist())
     target_t = Circle(MyEnv,size=TARGET_SIZE, line_width = 2)
     target_t.setFillColor(RED)
     dist_t = CrossDiag(MyEnv,size=DISTRACTOR_SIZE, line_width = 2)
@@ -812,10 +1035,10 @@ def displayTestScreen(MyEnv, ecc, n):
     mark = "BG"
     while not pressed:
         MyEnv.surf.fill(BACKGROUND)
-        for angle in tar_positions:
+        for pos_deg, pos_polar, pos in positions:
             ##angle = i/float(n) * 360
-            target_t.setPos(polToCart(ecc, angle))
-            dist_t.setPos(polToCart(ecc, angle))
+            target_t.setPosComputed(pos_deg, pos_polar, pos)
+            dist_t.setPosComputed(pos_deg, pos_polar, pos)
             if distractor_shown:
                 dist_t.draw()
             target_t.draw()